@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# S3 prefix(또는 키 목록 파일)의 이미지 전체를 한 번에 처리하는 일괄 실행 (행사 당일 백필용)
+# 얼굴 검출 → SAM(predict_batch_fn으로 배치) → 소스 자르기 → imgMake → faceSwap 을 한 프로세스에서 실행
+# 결과는 항목별 한 줄(JSON Lines) manifest에 바로 기록하고, 다시 실행하면 끝난 항목은 건너뜀
+BATCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BATCH_DIR, '..', 'lambda'))
+sys.path.insert(0, os.path.join(BATCH_DIR, '..', '도커'))
+
+# 한 프로세스가 여러 요청을 동시에 처리하므로 프로세스 단위 request_id를 쓰는 telemetry는 기본으로 끔
+os.environ.setdefault('TELEMETRY_ENABLED', '0')
+
+import s3_io
+import face_detect
+import imgCutting
+import imgMake
+import faceSwap
+from batching import MicroBatcher
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+FINISHED_STATUSES = ('done', 'no_face', 'duplicate')
+
+def list_images(bucket, prefix):
+    paginator = s3_io.s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].lower().endswith(IMAGE_EXTENSIONS):
+                yield obj['Key'], obj['ETag'].strip('"')
+
+def read_manifest(bucket, path):
+    # 한 줄에 키 하나 (또는 {"key": ...} JSON), ETag는 head_object로 조회
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            key = json.loads(line)['key'] if line.startswith('{') else line
+            etag = s3_io.s3_client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+            yield key, etag
+
+def make_request_id(bucket, key, etag):
+    # 같은 이미지면 다시 실행해도 같은 request_id -> 같은 S3 경로를 써서 이미 만든 중간 결과를 재사용
+    return 'batch-' + hashlib.sha256(f'{bucket}/{key}/{etag}'.encode('utf-8')).hexdigest()[:32]
+
+def load_results(path):
+    # 이전 실행 결과 (같은 키가 여러 번 있으면 마지막 줄이 최신)
+    results = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    results[record['key']] = record
+    return results
+
+class ResultWriter:
+    # 항목이 끝날 때마다 바로 한 줄씩 추가 (중간에 중단돼도 끝난 항목은 남음)
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.file.flush()
+            self.counts[record['status']] = self.counts.get(record['status'], 0) + 1
+
+    def close(self):
+        self.file.close()
+
+class GalleryBatch:
+    def __init__(self, bucket, model, writer, max_faces=8, sam_batch_size=4, sam_max_wait_ms=50,
+                 detect_concurrency=8, generate_concurrency=4, swap_concurrency=2):
+        self.bucket = bucket
+        self.writer = writer
+        self.max_faces = max_faces
+        # 여러 항목의 SAM 요청을 모아 predict_batch_fn 한 번으로 처리 (SAM 컨테이너와 같은 배처 사용)
+        import inference
+        self.sam = MicroBatcher(lambda inputs: inference.predict_batch_fn(inputs, model), sam_batch_size, sam_max_wait_ms)
+        # 단계별 동시 실행 수 제한 (Bedrock TPS, ReActor GPU 등 단계마다 병목이 다름)
+        self.limits = {
+            'detect': threading.Semaphore(detect_concurrency),
+            'generate': threading.Semaphore(generate_concurrency),
+            'swap': threading.Semaphore(swap_concurrency)
+        }
+
+    def process(self, key, etag):
+        request_id = make_request_id(self.bucket, key, etag)
+        prefix = f'path/to/{request_id}'
+        record = {'key': key, 'etag': etag, 'request_id': request_id, 'status': 'failed', 'stage': None}
+        started = time.perf_counter()
+        try:
+            record['stage'] = 'detect'
+            with self.limits['detect']:
+                bounding_boxes = face_detect.detect_faces(bucket=self.bucket, key=key)[:self.max_faces]
+            record['faces'] = len(bounding_boxes)
+            if not bounding_boxes:
+                record['status'] = 'no_face'
+                return record
+
+            # 이전 실행에서 만든 중간 결과가 있으면 그 단계는 건너뜀
+            record['stage'] = 'segment'
+            if not s3_io.object_exists(self.bucket, f'{prefix}/source_image.png'):
+                prediction = self.sam.submit({
+                    'request_id': request_id,
+                    'bucket': self.bucket,
+                    'key': key,
+                    'bounding_box': bounding_boxes[0],
+                    'bounding_boxes': bounding_boxes
+                })
+                imgCutting.write_source_image(
+                    self.bucket, request_id, key, prediction['masks'], bounding_boxes[0], len(bounding_boxes)
+                )
+
+            # 단계 함수를 idempotency 기록 없이 직접 호출 (중단 후 다시 실행할 때 남은 in_progress 기록 때문에
+            # 건너뛰지 않도록, 재개 여부는 위와 같이 S3 중간 결과로 판단)
+            record['stage'] = 'generate'
+            if not s3_io.object_exists(self.bucket, f'{prefix}/target.png'):
+                with self.limits['generate']:
+                    response = imgMake.make_target({
+                        'bucket': self.bucket,
+                        'image_key': key,
+                        'request_id': request_id,
+                        'bounding_box': bounding_boxes[0],
+                        'face_count': len(bounding_boxes)
+                    })
+                if response.get('statusCode') != 200:
+                    raise RuntimeError(response.get('body'))
+
+            record['stage'] = 'swap'
+            swapped_key = f'{prefix}/swapped_image.png'
+            if not s3_io.object_exists(self.bucket, swapped_key):
+                with self.limits['swap']:
+                    response = faceSwap.swap_faces({'bucket': self.bucket, 'request_id': request_id})
+                if response.get('statusCode') != 200:
+                    raise RuntimeError(response.get('body'))
+
+            record.update({'status': 'done', 'stage': None, 'output_key': swapped_key})
+            return record
+        except Exception as e:
+            print(f"Failed {key} at {record['stage']}: {e}")
+            record['error'] = str(e)
+            return record
+        finally:
+            record['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+            self.writer.write(record)
+
+def select_items(items, previous):
+    # ETag가 같은 이미지(같은 내용 재업로드)는 한 번만 처리하고, 이전 실행에서 끝난 항목은 건너뜀
+    todo = []
+    duplicates = []
+    seen = {}
+    for key, etag in items:
+        if etag in seen:
+            if previous.get(key, {}).get('status') != 'duplicate':
+                duplicates.append({'key': key, 'etag': etag, 'status': 'duplicate', 'duplicate_of': seen[etag]})
+            continue
+        seen[etag] = key
+        done = previous.get(key)
+        if done and done['etag'] == etag and done['status'] in FINISHED_STATUSES:
+            continue
+        todo.append((key, etag))
+    return todo, duplicates
+
+def main():
+    parser = argparse.ArgumentParser(description='S3 prefix 전체를 일괄 처리하는 갤러리 배치')
+    parser.add_argument('bucket')
+    parser.add_argument('--prefix', default='', help='처리할 원본 이미지 prefix')
+    parser.add_argument('--manifest', help='prefix 대신 처리할 키 목록 파일 (한 줄에 키 하나)')
+    parser.add_argument('--results', default='gallery_results.jsonl', help='항목별 결과 manifest (재실행 시 이어서 처리)')
+    parser.add_argument('--results-s3-key', help='끝난 뒤 결과 manifest를 업로드할 S3 키')
+    parser.add_argument('--model-dir', default='/opt/ml/model', help='SAM 모델 폴더 (도커/inference.model_fn)')
+    parser.add_argument('--max-faces', type=int, default=int(os.environ.get('MAX_FACES', '8')))
+    parser.add_argument('--max-in-flight', type=int, default=16, help='동시에 진행 중인 항목 수')
+    parser.add_argument('--sam-batch-size', type=int, default=4)
+    parser.add_argument('--detect-concurrency', type=int, default=8)
+    parser.add_argument('--generate-concurrency', type=int, default=4)
+    parser.add_argument('--swap-concurrency', type=int, default=2)
+    args = parser.parse_args()
+
+    if args.manifest:
+        items = list(read_manifest(args.bucket, args.manifest))
+    else:
+        items = list(list_images(args.bucket, args.prefix))
+    todo, duplicates = select_items(items, load_results(args.results))
+    print(f"{len(items)} images, {len(todo)} to process, {len(duplicates)} duplicates, "
+          f"{len(items) - len(todo) - len(duplicates)} already finished")
+
+    import inference
+    started = time.perf_counter()
+    model = inference.model_fn(args.model_dir)
+    print(f"SAM model loaded in {time.perf_counter() - started:.2f}s")
+
+    writer = ResultWriter(args.results)
+    for record in duplicates:
+        writer.write(record)
+    batch = GalleryBatch(
+        args.bucket, model, writer,
+        max_faces=args.max_faces,
+        sam_batch_size=args.sam_batch_size,
+        detect_concurrency=args.detect_concurrency,
+        generate_concurrency=args.generate_concurrency,
+        swap_concurrency=args.swap_concurrency
+    )
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as executor:
+        for i, record in enumerate(executor.map(lambda item: batch.process(*item), todo), 1):
+            print(f"[{i}/{len(todo)}] {record['key']}: {record['status']}")
+    writer.close()
+    print(f"Finished in {time.perf_counter() - started:.1f}s: {writer.counts}")
+
+    if args.results_s3_key:
+        with open(args.results, 'rb') as f:
+            s3_io.upload_bytes(f.read(), args.bucket, args.results_s3_key, content_type='application/x-ndjson')
+        print(f"Results manifest uploaded to s3://{args.bucket}/{args.results_s3_key}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# lambda 폴더의 모듈을 그대로 사용
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+import face_detect
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def box_iou(a, b):
+    left = max(a['Left'], b['Left'])
+    top = max(a['Top'], b['Top'])
+    right = min(a['Left'] + a['Width'], b['Left'] + b['Width'])
+    bottom = min(a['Top'] + a['Height'], b['Top'] + b['Height'])
+    intersection = max(0.0, right - left) * max(0.0, bottom - top)
+    union = a['Width'] * a['Height'] + b['Width'] * b['Height'] - intersection
+    return intersection / union if union > 0 else 0.0
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def main():
+    parser = argparse.ArgumentParser(description='얼굴 검출 백엔드 지연 시간 비교')
+    parser.add_argument('image_dir', help='테스트 이미지 폴더')
+    parser.add_argument('--detectors', default='rekognition,opencv')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    images = []
+    for name in sorted(os.listdir(args.image_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(args.image_dir, name), 'rb') as f:
+                images.append((name, f.read()))
+    if not images:
+        sys.exit(f"No images found in {args.image_dir}")
+
+    detector_names = args.detectors.split(',')
+    latencies = {name: [] for name in detector_names}
+    first_boxes = {name: {} for name in detector_names}
+
+    for name in detector_names:
+        started = time.perf_counter()
+        face_detect.get_detector(name)
+        print(f"{name}: loaded in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        for image_name, image_bytes in images:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                boxes = face_detect.detect_faces(image_bytes=image_bytes, detector=name)
+                latencies[name].append((time.perf_counter() - started) * 1000)
+            first_boxes[name][image_name] = boxes[0] if boxes else None
+
+    print(f"\n{len(images)} images x {args.repeat} runs")
+    print(f"{'detector':<12} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'found':>6}")
+    for name in detector_names:
+        found = sum(1 for box in first_boxes[name].values() if box)
+        print(f"{name:<12} {percentile(latencies[name], 50):>8.1f} {percentile(latencies[name], 95):>8.1f} "
+              f"{statistics.mean(latencies[name]):>8.1f} {found:>6}")
+
+    # 첫 번째 백엔드를 기준으로 대표 얼굴 박스 일치도 비교
+    reference = detector_names[0]
+    for name in detector_names[1:]:
+        ious = [
+            box_iou(first_boxes[reference][image_name], first_boxes[name][image_name])
+            for image_name, _ in images
+            if first_boxes[reference][image_name] and first_boxes[name][image_name]
+        ]
+        if ious:
+            print(f"IoU {name} vs {reference}: mean {statistics.mean(ious):.3f}, min {min(ious):.3f} ({len(ious)} images)")
+
+if __name__ == '__main__':
+    main()
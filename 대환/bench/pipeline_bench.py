@@ -0,0 +1,284 @@
+import argparse
+import importlib.util
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext, redirect_stdout
+
+import boto3
+import numpy as np
+from PIL import Image, ImageDraw
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCH_DIR, '..', 'lambda')
+CONTAINER_DIR = os.path.join(BENCH_DIR, '..', '도커')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, LAMBDA_DIR)
+sys.path.insert(0, CONTAINER_DIR)
+import stubs
+
+# 파이프라인 전체(sagemaker-asy → SAM → imgCutting → imgMake → faceSwap)를 로컬 대역으로 실행하는 벤치마크
+BUCKET = 'bench-bucket'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+class StageTimer:
+    # 단계별 실행 시간 (중첩 호출된 단계 시간은 빼고 기록)
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.stack = []
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        self.stack.append(0.0)
+        try:
+            yield
+        finally:
+            nested = self.stack.pop()
+            elapsed = time.perf_counter() - started
+            self.samples[name].append((elapsed - nested) * 1000)
+            if self.stack:
+                self.stack[-1] += elapsed
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def s3_event(s3, bucket, key):
+    etag = s3.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    return {'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key, 'eTag': etag}}}]}
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def synthetic_image(width, height):
+    # 압축률이 실제 사진과 비슷하도록 그라데이션 배경 + 얼굴 모양 타원
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                       np.full((height, width), 128, np.float32)], axis=-1)
+    pixels += np.random.default_rng(0).normal(0, 6, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    ImageDraw.Draw(image).ellipse((width * 0.35, height * 0.2, width * 0.65, height * 0.6), fill=(225, 190, 160))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def load_corpus(args):
+    if args.image_dir:
+        corpus = []
+        for name in sorted(os.listdir(args.image_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(args.image_dir, name), 'rb') as f:
+                    corpus.append((name, f.read()))
+        return corpus
+    return [
+        (f'synthetic-{size}.jpg', synthetic_image(*map(int, size.split('x'))))
+        for size in args.sizes.split(',')
+    ]
+
+def load_sam_model(inference, args):
+    if args.model_dir:
+        return inference.model_fn(args.model_dir)
+
+    # 체크포인트가 없으면 아주 작은 랜덤 가중치 SAM으로 실행 (정확도가 아닌 처리 경로/오버헤드 측정용)
+    from segment_anything.build_sam import _build_sam
+    return _build_sam(
+        encoder_embed_dim=64,
+        encoder_depth=1,
+        encoder_num_heads=2,
+        encoder_global_attn_indexes=[0]
+    ).eval()
+
+def main():
+    parser = argparse.ArgumentParser(description='로컬 대역을 사용한 전체 파이프라인 벤치마크')
+    parser.add_argument('--image-dir', help='테스트 이미지 폴더 (없으면 --sizes 크기의 합성 이미지 사용)')
+    parser.add_argument('--sizes', default='640x480,1920x1080,4000x3000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model-dir', help='model_fn에 넘길 SAM 모델 폴더 (없으면 작은 랜덤 모델)')
+    parser.add_argument('--mode', default='sequential', choices=['sequential', 'parallel'])
+    parser.add_argument('--faces', type=int, default=1, help='Rekognition 대역이 검출할 얼굴 수 (단체 사진 경로 측정)')
+    parser.add_argument('--bedrock-latency-ms', type=float, default=0)
+    parser.add_argument('--reactor-latency-ms', type=float, default=0)
+    parser.add_argument('--no-embedding-cache', action='store_true', help='SAM 임베딩 캐시를 끄고 매번 인코더 실행')
+    parser.add_argument('--duplicate-events', action='store_true', help='S3 이벤트를 두 번씩 전달 (중복 실행 방지 확인)')
+    parser.add_argument('--trace-memory', action='store_true', help='단계별 Python 메모리 최대 사용량 측정 (느려짐)')
+    parser.add_argument('--json-out', help='결과를 JSON으로 저장할 경로')
+    parser.add_argument('--quiet', action='store_true', help='각 Lambda의 로그 출력 숨기기')
+    args = parser.parse_args()
+
+    timer = StageTimer()
+    reactor = stubs.StubReActor(latency_ms=args.reactor_latency_ms)
+    s3 = stubs.StubS3()
+    dynamodb = stubs.StubDynamoDB({
+        'RequestMappingTable': 'OutputUUID',
+        'PipelineJoinTable': 'RequestID',
+        'BedrockCacheTable': 'CacheKey',
+        'TargetPoolClaimTable': 'ItemKey',
+        'IdempotencyTable': 'IdempotencyKey'
+    })
+    bedrock = stubs.StubBedrock(latency_ms=args.bedrock_latency_ms)
+    sagemaker_runtime = stubs.StubSageMakerRuntime()
+    handlers = {}
+    clients = {
+        's3': s3,
+        'dynamodb': dynamodb,
+        'lambda': stubs.StubLambda(handlers, timer),
+        'bedrock-runtime': bedrock,
+        'rekognition': stubs.StubRekognition(args.faces),
+        'sagemaker-runtime': sagemaker_runtime
+    }
+
+    # 모듈 레벨에서 만들어지는 boto3 클라이언트까지 대역으로 바꾸기 위해 import 전에 설정
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['REACTOR_URL'] = reactor.url
+    os.environ['PIPELINE_MODE'] = args.mode
+    os.environ.setdefault('FACE_DETECTOR', 'rekognition')
+    if args.no_embedding_cache:
+        os.environ['SAM_EMBEDDING_CACHE_BYTES'] = '0'
+    boto3.client = lambda service_name, *client_args, **client_kwargs: clients[service_name]
+
+    sagemaker_asy = load_module('sagemaker_asy', os.path.join(LAMBDA_DIR, 'sagemaker-asy.py'))
+    import imgCutting
+    import imgMake
+    import faceSwap
+    import replenishPool
+    import inference
+    handlers.update({'imgMake': imgMake.lambda_handler, 'faceSwap': faceSwap.lambda_handler, 'replenishPool': replenishPool.lambda_handler})
+
+    started = time.perf_counter()
+    model = load_sam_model(inference, args)
+    print(f"SAM model loaded in {time.perf_counter() - started:.2f}s")
+
+    corpus = load_corpus(args)
+    if not corpus:
+        sys.exit("No images to benchmark")
+
+    memory_peaks = defaultdict(list)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    @contextmanager
+    def step(name):
+        # 최상위 단계: 시간 + (선택) 메모리 최대 사용량
+        if args.trace_memory:
+            tracemalloc.reset_peak()
+        with timer.stage(name):
+            yield
+        if args.trace_memory:
+            memory_peaks[name].append(tracemalloc.get_traced_memory()[1])
+
+    def check(name, response):
+        if not response or response.get('statusCode') != 200:
+            timer.failures[name] += 1
+            print(f"{name} failed: {response}", file=sys.stderr)
+
+    duplicate_sam_jobs = 0
+    quiet = redirect_stdout(io.StringIO()) if args.quiet else nullcontext()
+    with quiet:
+        for run in range(args.repeat):
+            for image_name, image_bytes in corpus:
+                key = f'upload/{run}-{image_name}'
+                s3.put(BUCKET, key, image_bytes, 'image/jpeg')
+
+                event = s3_event(s3, BUCKET, key)
+                with step('sagemaker-asy'):
+                    check('sagemaker-asy', sagemaker_asy.lambda_handler(event, None))
+                if args.duplicate_events:
+                    # S3 이벤트 알림 중복 전달 (IDEMPOTENCY_BACKEND를 켜면 건너뛰어야 함)
+                    with step('sagemaker-asy (dup)'):
+                        sagemaker_asy.lambda_handler(event, None)
+                if not sagemaker_runtime.pending:
+                    continue
+                job = sagemaker_runtime.pending.pop(0)
+                # 중복 이벤트로 다시 제출된 SAM 작업은 세기만 하고 실행하지 않음
+                duplicate_sam_jobs += len(sagemaker_runtime.pending)
+                sagemaker_runtime.pending.clear()
+
+                # SageMaker 비동기 추론 대역: input_fn → predict_fn → output_fn 결과를 .out으로 저장
+                input_key = job['input_location'].split('/', 3)[3]
+                request_body = s3.get_object(Bucket=BUCKET, Key=input_key)['Body'].read()
+                with step('sam'):
+                    data = inference.input_fn(request_body, job['content_type'])
+                    prediction = inference.predict_fn(data, model)
+                    output, _ = inference.output_fn(prediction, job['accept'])
+                if isinstance(output, str):
+                    output = output.encode('utf-8')
+                s3.put(BUCKET, job['output_key'], output)
+                dynamodb.put_item(TableName='RequestMappingTable', Item={
+                    'OutputUUID': {'S': job['output_uuid']},
+                    'RequestID': {'S': json.loads(request_body)['request_id']}
+                })
+
+                event = s3_event(s3, BUCKET, job['output_key'])
+                with step('imgCutting'):
+                    check('imgCutting', imgCutting.lambda_handler(event, None))
+                    clients['lambda'].drain()
+                if args.duplicate_events:
+                    with step('imgCutting (dup)'):
+                        imgCutting.lambda_handler(event, None)
+                        clients['lambda'].drain()
+
+    reactor.close()
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    report = {
+        'images': len(corpus),
+        'repeat': args.repeat,
+        'mode': args.mode,
+        'faces': args.faces,
+        'duplicate_sam_jobs': duplicate_sam_jobs,
+        'stages': {},
+        'payloads': {},
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+    print(f"\n{len(corpus)} images x {args.repeat} runs, mode={args.mode}, faces={args.faces}")
+    print(f"{'stage':<14} {'count':>5} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'fail':>5} {'py peak MB':>11}")
+    for name, samples in timer.samples.items():
+        peak_mb = max(memory_peaks[name]) / 1024 / 1024 if memory_peaks[name] else None
+        report['stages'][name] = {
+            'count': len(samples),
+            'p50_ms': percentile(samples, 50),
+            'p95_ms': percentile(samples, 95),
+            'max_ms': max(samples),
+            'failures': timer.failures[name],
+            'python_peak_mb': peak_mb
+        }
+        peak_text = f"{peak_mb:.1f}" if peak_mb is not None else '-'
+        print(f"{name:<14} {len(samples):>5} {percentile(samples, 50):>9.1f} {percentile(samples, 95):>9.1f} "
+              f"{max(samples):>9.1f} {timer.failures[name]:>5} {peak_text:>11}")
+
+    payloads = dict(s3.put_sizes)
+    for model_id, sizes in bedrock.request_bytes.items():
+        payloads[f'bedrock request ({model_id})'] = sizes
+    payloads['reactor request'] = reactor.request_bytes
+
+    print(f"\n{'payload':<60} {'count':>5} {'mean KB':>10} {'max KB':>10}")
+    for name, sizes in payloads.items():
+        if not sizes:
+            continue
+        report['payloads'][name] = {'count': len(sizes), 'mean_bytes': statistics.mean(sizes), 'max_bytes': max(sizes)}
+        print(f"{name:<60} {len(sizes):>5} {statistics.mean(sizes) / 1024:>10.1f} {max(sizes) / 1024:>10.1f}")
+
+    if args.duplicate_events:
+        print(f"\nDuplicate SAM jobs submitted: {duplicate_sam_jobs}")
+    print(f"\nPeak RSS: {report['peak_rss_mb']:.1f} MB")
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+import numpy as np
+
+# SAM 엔진/백본별 지연 시간과 마스크 품질 비교 (SAM_ENGINE, SAM_MODEL_TYPE, SAM_WEIGHTS_DTYPE 선택용)
+# 첫 번째 설정을 기준으로 얼굴 마스크 IoU를 계산 (기본 기준: 지금 운영 중인 torch ViT-H float32)
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'lambda'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', '도커'))
+os.environ.setdefault('TELEMETRY_ENABLED', '0')
+os.environ.setdefault('FACE_DETECTOR', 'opencv')
+
+import torch
+import face_detect
+import inference
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def mask_iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return np.logical_and(a, b).sum() / union if union else 1.0
+
+def parse_config(text):
+    # engine:model_type[:weights_dtype] (예: torch:vit_h, onnx:vit_b:int8)
+    parts = text.split(':')
+    return parts[0], parts[1], parts[2] if len(parts) > 2 else 'float32'
+
+def main():
+    parser = argparse.ArgumentParser(description='SAM 엔진/백본 지연 시간과 얼굴 마스크 품질 비교')
+    parser.add_argument('image_dir', help='얼굴 테스트 이미지 폴더')
+    parser.add_argument('--model-dir', default='/opt/ml/model', help='SAM 체크포인트(.pth)가 있는 폴더')
+    parser.add_argument('--configs', default='torch:vit_h,torch:vit_b,onnx:vit_b,onnx:vit_b:int8',
+                        help='engine:model_type[:weights_dtype] 목록, 첫 번째가 품질 기준')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='연산 스레드 수 (0이면 CPU 코어 수)')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # 얼굴 박스는 한 번만 검출해서 모든 설정에 같은 프롬프트를 사용
+    images = []
+    for name in sorted(os.listdir(args.image_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(args.image_dir, name), 'rb') as f:
+                image_bytes = f.read()
+            boxes = face_detect.detect_faces(image_bytes=image_bytes)
+            if boxes:
+                images.append((name, image_bytes, boxes))
+            else:
+                print(f"{name}: no face detected, skipped")
+    if not images:
+        sys.exit(f"No images with faces found in {args.image_dir}")
+
+    configs = args.configs.split(',')
+    results = {}
+    for config in configs:
+        engine, model_type, weights_dtype = parse_config(config)
+        started = time.perf_counter()
+        model = inference.load_model(args.model_dir, engine, model_type, weights_dtype)
+        if isinstance(model, inference.OnnxSam):
+            # onnxruntime 세션 생성도 시작 시간에 포함
+            model.get_sessions()
+        load_seconds = time.perf_counter() - started
+        predictor = inference.get_predictor(model)
+
+        encode_ms = []
+        decode_ms = []
+        masks = {}
+        for name, image_bytes, boxes in images:
+            image = inference.decode_image(image_bytes)
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                embedding = inference.encode_images(model, predictor, [image])[0]
+                encode_ms.append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                prediction = inference.predict_with_embedding(predictor, embedding, boxes)
+                decode_ms.append((time.perf_counter() - started) * 1000)
+            # imgCutting과 같이 얼굴마다 첫 번째 마스크 사용
+            masks[name] = np.asarray(prediction['masks'])[:len(boxes)]
+        results[config] = {'load': load_seconds, 'encode': encode_ms, 'decode': decode_ms, 'masks': masks}
+        print(f"{config}: loaded in {load_seconds:.2f}s, encode p50 {percentile(encode_ms, 50):.0f} ms")
+        del model, predictor
+
+    reference = configs[0]
+    print(f"\n{len(images)} images x {args.repeat} runs, quality reference: {reference}")
+    print(f"{'config':<22} {'load s':>7} {'enc p50':>8} {'enc p95':>8} {'dec p50':>8} {'speedup':>8} {'IoU mean':>9} {'IoU min':>8}")
+    reference_ms = percentile(results[reference]['encode'], 50) + percentile(results[reference]['decode'], 50)
+    for config in configs:
+        result = results[config]
+        total_ms = percentile(result['encode'], 50) + percentile(result['decode'], 50)
+        ious = [
+            mask_iou(mask, reference_mask)
+            for name, _, _ in images
+            for mask, reference_mask in zip(result['masks'][name], results[reference]['masks'][name])
+        ]
+        print(f"{config:<22} {result['load']:>7.2f} {percentile(result['encode'], 50):>8.0f} "
+              f"{percentile(result['encode'], 95):>8.0f} {percentile(result['decode'], 50):>8.1f} "
+              f"{reference_ms / total_ms:>7.2f}x {statistics.mean(ious):>9.3f} {min(ious):>8.3f}")
+
+if __name__ == '__main__':
+    main()
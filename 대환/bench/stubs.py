@@ -0,0 +1,329 @@
+import base64
+import copy
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from PIL import Image, ImageDraw
+
+# 파이프라인 벤치마크용 로컬 대역 (S3, DynamoDB, Lambda, Bedrock, Rekognition, SageMaker, ReActor)
+
+def client_error(code, operation, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+class StubS3:
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.bytes_in = defaultdict(int)
+        self.bytes_out = defaultdict(int)
+        self.put_sizes = defaultdict(list)
+
+    def put(self, bucket, key, data, content_type=None, metadata=None):
+        with self.lock:
+            self.objects[(bucket, key)] = {
+                'Body': bytes(data),
+                'ContentType': content_type or 'binary/octet-stream',
+                'Metadata': dict(metadata or {}),
+                'LastModified': datetime.now(timezone.utc),
+                'ETag': f'"{hashlib.md5(data).hexdigest()}"'  # 단일 PUT의 S3 ETag와 같이 내용의 MD5
+            }
+            self.bytes_in[key] += len(data)
+            self.put_sizes[artifact_name(key)].append(len(data))
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None, **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        self.put(Bucket, Key, Body, ContentType, Metadata)
+        return {'ETag': self.objects[(Bucket, Key)]['ETag']}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        extra_args = ExtraArgs or {}
+        self.put(Bucket, Key, Fileobj.read(), extra_args.get('ContentType'), extra_args.get('Metadata'))
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise client_error('NoSuchKey', 'GetObject', Key)
+        data = obj['Body']
+        self.bytes_out[Key] += len(data)
+        response = {key: value for key, value in obj.items() if key != 'Body'}
+        response['Body'] = StreamingBody(io.BytesIO(data), len(data))
+        response['ContentLength'] = len(data)
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise client_error('404', 'HeadObject', Key)
+        response = {key: value for key, value in obj.items() if key != 'Body'}
+        response['ContentLength'] = len(obj['Body'])
+        return response
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        source = self.get_object(CopySource['Bucket'], CopySource['Key'])
+        self.put(Bucket, Key, source['Body'].read(), source['ContentType'], source['Metadata'])
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        with self.lock:
+            contents = [
+                {
+                    'Key': key,
+                    'Size': len(obj['Body']),
+                    'ETag': obj['ETag'],
+                    'LastModified': obj['LastModified']
+                }
+                for (bucket, key), obj in sorted(self.objects.items())
+                if bucket == Bucket and key.startswith(Prefix)
+            ]
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+    def get_paginator(self, operation_name):
+        stub = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                yield getattr(stub, operation_name)(**kwargs)
+
+        return Paginator()
+
+def artifact_name(key):
+    # 요청별 경로를 지우고 산출물 종류별로 묶음 (예: path/to/{id}/target.png -> target.png)
+    if key.endswith('.out'):
+        return '.out (SAM output)'
+    if key.startswith('input/'):
+        return 'input/*.json'
+    if key.startswith('upload/'):
+        return 'upload (original)'
+    return key.rsplit('/', 1)[-1]
+
+class StubDynamoDB:
+    # 파이프라인에서 쓰는 식(ADD / SET / attribute_(not_)exists)만 지원
+    # key_schema: 테이블 이름 -> 파티션 키 이름 (put_item에서 키를 찾을 때 사용)
+    def __init__(self, key_schema):
+        self.key_schema = dict(key_schema)
+        self.tables = defaultdict(dict)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def item_key(Key):
+        return json.dumps(Key, sort_keys=True)
+
+    def get_item(self, TableName, Key, **kwargs):
+        with self.lock:
+            item = self.tables[TableName].get(self.item_key(Key))
+        return {'Item': copy.deepcopy(item)} if item else {}
+
+    def check_condition(self, item, condition, operation, values=None):
+        if not condition:
+            return
+        for function, name in re.findall(r'(attribute_not_exists|attribute_exists)\((\w+)\)', condition):
+            exists = item is not None and name in item
+            if (function == 'attribute_exists') != exists:
+                raise client_error('ConditionalCheckFailedException', operation)
+        # 숫자 비교 (name = :value, name < :value)
+        for name, operator, value in re.findall(r'(\w+)\s*([=<])\s*(:\w+)', condition):
+            if item is None or name not in item:
+                raise client_error('ConditionalCheckFailedException', operation)
+            current = float(item[name]['N'])
+            expected = float(values[value]['N'])
+            if not (current == expected if operator == '=' else current < expected):
+                raise client_error('ConditionalCheckFailedException', operation)
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        key_name = self.key_schema[TableName]
+        key = {key_name: Item[key_name]}
+        with self.lock:
+            self.check_condition(self.tables[TableName].get(self.item_key(key)), ConditionExpression, 'PutItem',
+                                 ExpressionAttributeValues)
+            self.tables[TableName][self.item_key(key)] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ConditionExpression=None, ReturnValues='NONE', ExpressionAttributeNames=None, **kwargs):
+        values = ExpressionAttributeValues or {}
+        for placeholder, name in (ExpressionAttributeNames or {}).items():
+            UpdateExpression = UpdateExpression.replace(placeholder, name)
+        with self.lock:
+            item = self.tables[TableName].get(self.item_key(Key))
+            self.check_condition(item, ConditionExpression, 'UpdateItem', values)
+            item = dict(item or Key)
+            for action, body in re.findall(r'(ADD|SET)\s+(.*?)(?=\s+(?:ADD|SET)\s+|$)', UpdateExpression):
+                for part in body.split(','):
+                    if action == 'SET':
+                        name, value = [token.strip() for token in part.split('=')]
+                        item[name] = values[value]
+                    else:
+                        name, value = part.split()
+                        value = values[value]
+                        if 'SS' in value:
+                            item[name] = {'SS': sorted(set(item.get(name, {'SS': []})['SS']) | set(value['SS']))}
+                        else:
+                            item[name] = {'N': str(float(item.get(name, {'N': '0'})['N']) + float(value['N']))}
+            self.tables[TableName][self.item_key(Key)] = item
+        return {'Attributes': copy.deepcopy(item)} if ReturnValues != 'NONE' else {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        with self.lock:
+            self.tables[TableName].pop(self.item_key(Key), None)
+        return {}
+
+class StubLambda:
+    # 동기 호출은 바로 실행, 비동기(Event) 호출은 큐에 넣었다가 drain()에서 실행
+    def __init__(self, handlers, timer):
+        self.handlers = handlers
+        self.timer = timer
+        self.pending = []
+
+    def run(self, function_name, payload):
+        with self.timer.stage(function_name):
+            return self.handlers[function_name](payload, None)
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse', **kwargs):
+        payload = json.loads(Payload)
+        if InvocationType == 'Event':
+            self.pending.append((FunctionName, payload))
+            return {'StatusCode': 202, 'Payload': io.BytesIO(b'')}
+        result = self.run(FunctionName, payload)
+        return {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps(result).encode('utf-8'))}
+
+    def drain(self):
+        while self.pending:
+            function_name, payload = self.pending.pop(0)
+            self.run(function_name, payload)
+
+def make_target_png(size=1024):
+    # Titan 대역: 가운데 얼굴 모양이 있는 단순한 이미지
+    image = Image.new('RGB', (size, size), (90, 120, 160))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((size * 0.35, size * 0.2, size * 0.65, size * 0.6), fill=(225, 190, 160))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+CLAUDE_TEXT = ("Hairstyle: short black hair\nGender: male\nSkin tone: light\n###\n"
+               "You are a firefighter who once rescued a cat from a ladder truck while the whole town "
+               "cheered and the mayor handed you a medal shaped like a fire hydrant.")
+
+class StubBedrock:
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000.0
+        self.request_bytes = defaultdict(list)
+        self.streamed_chunks = defaultdict(list)
+        self.target_base64 = base64.b64encode(make_target_png()).decode('ascii')
+
+    def respond(self, modelId, body):
+        if 'titan' in modelId:
+            return {'images': [self.target_base64], 'error': None}
+        return {'content': [{'type': 'text', 'text': CLAUDE_TEXT}]}
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self.request_bytes[modelId].append(len(body))
+        time.sleep(self.latency)
+        data = json.dumps(self.respond(modelId, json.loads(body))).encode('utf-8')
+        return {'body': StreamingBody(io.BytesIO(data), len(data))}
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        # 첫 토큰까지 latency_ms의 절반, 나머지는 토큰마다 조금씩 나눠서 전송
+        self.request_bytes[modelId].append(len(body))
+        self.streamed_chunks[modelId].append(0)
+        stub = self
+        tokens = re.findall(r'\S+\s*', CLAUDE_TEXT)
+
+        class EventStream:
+            def __iter__(self):
+                time.sleep(stub.latency / 2)
+                for token in tokens:
+                    time.sleep(stub.latency / 2 / len(tokens))
+                    stub.streamed_chunks[modelId][-1] += 1
+                    chunk = {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': token}}
+                    yield {'chunk': {'bytes': json.dumps(chunk).encode('utf-8')}}
+
+            def close(self):
+                pass
+
+        return {'body': EventStream()}
+
+class StubRekognition:
+    # 얼굴이 faces개 가로로 나란히 있다고 응답 (1개면 이미지 가운데)
+    def __init__(self, faces=1):
+        self.faces = faces
+
+    def detect_faces(self, Image, Attributes=None, **kwargs):
+        width = 0.3 / self.faces
+        return {'FaceDetails': [
+            {
+                'BoundingBox': {'Left': (i + 0.5) / self.faces - width / 2, 'Top': 0.2, 'Width': width, 'Height': 0.4},
+                'Confidence': 99.9
+            }
+            for i in range(self.faces)
+        ]}
+
+class StubSageMakerRuntime:
+    # 비동기 추론 요청을 기록만 하고, 실제 SAM 실행은 벤치마크가 직접 수행
+    def __init__(self):
+        self.pending = []
+
+    def invoke_endpoint_async(self, EndpointName, InputLocation, ContentType=None, Accept=None, **kwargs):
+        bucket = InputLocation[len('s3://'):].split('/', 1)[0]
+        output_uuid = str(uuid.uuid4())
+        output_key = f'succ/{output_uuid}.out'
+        self.pending.append({
+            'input_location': InputLocation,
+            'content_type': ContentType,
+            'accept': Accept,
+            'output_uuid': output_uuid,
+            'bucket': bucket,
+            'output_key': output_key
+        })
+        return {'OutputLocation': f's3://{bucket}/{output_key}', 'InferenceId': output_uuid}
+
+class StubReActor:
+    # ReActor API 대역: 타겟 이미지를 그대로 돌려줌
+    def __init__(self, latency_ms=0, port=0):
+        self.latency = latency_ms / 1000.0
+        self.request_bytes = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.request_bytes.append(len(body))
+                time.sleep(stub.latency)
+                data = json.loads(body)
+                response = json.dumps({'image': data['target_image']}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/reactor/image'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import random
+import time
+from collections import Counter
+import boto3
+from botocore.exceptions import ClientError
+import telemetry
+
+# Bedrock 응답 캐시 (요청 본문 해시 기반, content-addressed)
+# 백엔드: 'none' | 'disk' | 's3' | 'dynamodb'
+CACHE_BACKEND = os.environ.get('BEDROCK_CACHE_BACKEND', 'none')
+CACHE_TTL_SECONDS = int(os.environ.get('BEDROCK_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.environ.get('BEDROCK_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+CACHE_DIR = os.environ.get('BEDROCK_CACHE_DIR', '/tmp/bedrock-cache')
+CACHE_BUCKET = os.environ.get('BEDROCK_CACHE_BUCKET', '')
+CACHE_PREFIX = os.environ.get('BEDROCK_CACHE_PREFIX', 'cache/bedrock/')
+CACHE_TABLE = os.environ.get('BEDROCK_CACHE_TABLE', 'BedrockCacheTable')
+
+# S3 백엔드는 목록 조회 비용이 있으므로 저장할 때 일정 확률로만 크기 제한 정리를 수행
+S3_EVICT_PROBABILITY = float(os.environ.get('BEDROCK_CACHE_S3_EVICT_PROBABILITY', '0.05'))
+
+# DynamoDB 항목 크기 제한(400KB)보다 작게 유지
+DYNAMODB_MAX_VALUE_BYTES = 350 * 1024
+
+def make_key(namespace, *parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return f"{namespace}/{digest.hexdigest()}"
+
+class DiskCache:
+    # 로컬 디스크(/tmp 또는 EFS) 캐시: mtime으로 TTL과 LRU 순서를 관리
+    def __init__(self, directory, ttl_seconds, max_bytes):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        now = time.time()
+        for mtime, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes and now - mtime <= self.ttl_seconds:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+class S3Cache:
+    # S3 prefix 캐시: LastModified로 TTL을 판단하고 크기 제한은 오래된 객체부터 정리
+    def __init__(self, bucket, prefix, ttl_seconds, max_bytes):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.s3_client = boto3.client('s3')
+
+    def get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        if time.time() - response['LastModified'].timestamp() > self.ttl_seconds:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+            return None
+        return response['Body'].read()
+
+    def put(self, key, data):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+        if random.random() < S3_EVICT_PROBABILITY:
+            self.evict()
+
+    def evict(self):
+        objects = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            objects.extend(page.get('Contents', []))
+
+        total_bytes = sum(obj['Size'] for obj in objects)
+        now = time.time()
+        for obj in sorted(objects, key=lambda obj: obj['LastModified']):
+            if total_bytes <= self.max_bytes and now - obj['LastModified'].timestamp() <= self.ttl_seconds:
+                break
+            self.s3_client.delete_object(Bucket=self.bucket, Key=obj['Key'])
+            total_bytes -= obj['Size']
+
+class DynamoDBCache:
+    # DynamoDB 캐시 (파티션 키: CacheKey, TTL 속성: ExpiresAt)
+    # 항목 크기 제한 때문에 작은 응답(Claude 텍스트)만 저장하고, 만료는 테이블 TTL에 맡김
+    def __init__(self, table, ttl_seconds):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.dynamodb_client = boto3.client('dynamodb')
+
+    def get(self, key):
+        response = self.dynamodb_client.get_item(TableName=self.table, Key={'CacheKey': {'S': key}})
+        item = response.get('Item')
+        if item is None or int(item['ExpiresAt']['N']) < time.time():
+            return None
+        return item['Value']['B']
+
+    def put(self, key, data):
+        if len(data) > DYNAMODB_MAX_VALUE_BYTES:
+            print(f"Skipping DynamoDB cache for {key}: {len(data)} bytes is too large")
+            return
+        self.dynamodb_client.put_item(
+            TableName=self.table,
+            Item={
+                'CacheKey': {'S': key},
+                'Value': {'B': data},
+                'ExpiresAt': {'N': str(int(time.time()) + self.ttl_seconds)}
+            }
+        )
+
+def create_backend(name=CACHE_BACKEND):
+    if name == 'disk':
+        return DiskCache(CACHE_DIR, CACHE_TTL_SECONDS, CACHE_MAX_BYTES)
+    if name == 's3':
+        return S3Cache(CACHE_BUCKET, CACHE_PREFIX, CACHE_TTL_SECONDS, CACHE_MAX_BYTES)
+    if name == 'dynamodb':
+        return DynamoDBCache(CACHE_TABLE, CACHE_TTL_SECONDS)
+    if name == 'none':
+        return None
+    raise ValueError(f"Unsupported Bedrock cache backend: {name}")
+
+backend = create_backend()
+hits = Counter()
+misses = Counter()
+
+def is_enabled():
+    return backend is not None
+
+def stats():
+    return {
+        namespace: {
+            'hits': hits[namespace],
+            'misses': misses[namespace],
+            'hit_rate': hits[namespace] / (hits[namespace] + misses[namespace])
+        }
+        for namespace in set(hits) | set(misses)
+    }
+
+def call_model(client, namespace, model_id, body):
+    # 실제 Bedrock 호출 (캐시 적중 여부와 별개로 모델 지연 시간을 기록)
+    with telemetry.span('bedrock_invoke', namespace=namespace, model_id=model_id):
+        response = client.invoke_model(body=body, modelId=model_id, accept="application/json", contentType="application/json")
+        return response.get("body").read()
+
+def lookup(namespace, model_id, body):
+    # 캐시된 응답 본문(bytes) 또는 None (캐시를 안 쓰면 항상 None)
+    if backend is None:
+        return None
+    key = make_key(namespace, model_id, body)
+    try:
+        cached = backend.get(key)
+    except Exception as e:
+        print(f"Bedrock cache read failed for {key}: {e}")
+        cached = None
+
+    if cached is not None:
+        hits[namespace] += 1
+        telemetry.metric('BedrockCacheHit', 1, namespace=namespace)
+        print(f"Bedrock cache hit: {key}, stats: {stats()[namespace]}")
+    else:
+        misses[namespace] += 1
+        telemetry.metric('BedrockCacheMiss', 1, namespace=namespace)
+        print(f"Bedrock cache miss: {key}, stats: {stats()[namespace]}")
+    return cached
+
+def store(namespace, model_id, body, data):
+    if backend is None:
+        return
+    key = make_key(namespace, model_id, body)
+    try:
+        backend.put(key, data)
+    except Exception as e:
+        print(f"Bedrock cache write failed for {key}: {e}")
+
+def invoke_model(client, namespace, model_id, body, cacheable=None):
+    # 같은 모델 + 같은 요청 본문이면 캐시된 응답 본문(bytes)을 반환
+    cached = lookup(namespace, model_id, body)
+    if cached is not None:
+        return cached
+
+    data = call_model(client, namespace, model_id, body)
+    if cacheable is None or cacheable(data):
+        store(namespace, model_id, body, data)
+    return data
@@ -1,18 +1,69 @@
+import io
 import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import boto3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
+from PIL import Image, ImageDraw, ImageFilter
+import s3_io
+import face_detect
+import idempotency
+import telemetry
+import web_derivatives
 
-def send_face_swap_request(source_image_base64, target_image_base64):
-    # EC2 URL 입력
-    url = "http://18.181.247.202:7860/reactor/image"
+# ReActor 서버(EC2) 설정
+REACTOR_URL = os.environ.get('REACTOR_URL', "http://18.181.247.202:7860/reactor/image")
+REACTOR_CONNECT_TIMEOUT = float(os.environ.get('REACTOR_CONNECT_TIMEOUT', '3'))
+REACTOR_READ_TIMEOUT = float(os.environ.get('REACTOR_READ_TIMEOUT', '120'))
+REACTOR_MAX_RETRIES = int(os.environ.get('REACTOR_MAX_RETRIES', '3'))
+REACTOR_RETRY_BACKOFF = float(os.environ.get('REACTOR_RETRY_BACKOFF', '0.5'))
 
+# GPU 서버 한 대에 이 프로세스가 동시에 보내는 요청 수 상한
+# Lambda 컨테이너는 한 번에 요청 하나만 처리하므로 여러 스레드가 같이 보내는 배치 실행(batch/gallery_batch.py)에서만 의미가 있음
+# (Lambda 컨테이너 간 상한은 함수의 예약 동시성으로 설정)
+REACTOR_MAX_CONCURRENCY = int(os.environ.get('REACTOR_MAX_CONCURRENCY', '2'))
+
+def create_reactor_session():
+    # keep-alive 연결 풀 + 지수 백오프 재시도
+    # 서버가 요청을 받지 않은 것이 확실한 경우(연결 실패, 429/503)만 재시도
+    # 읽기 타임아웃이나 500/502/504는 GPU 서버에서 스왑이 아직 돌고 있을 수 있으므로 다시 보내지 않음 (느릴 때 부하가 배로 늘어남)
+    retry = Retry(
+        total=REACTOR_MAX_RETRIES,
+        connect=REACTOR_MAX_RETRIES,
+        read=0,
+        status=REACTOR_MAX_RETRIES,
+        backoff_factor=REACTOR_RETRY_BACKOFF,
+        status_forcelist=(429, 503),
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=REACTOR_MAX_CONCURRENCY, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# 컨테이너가 재사용되는 동안 연결을 유지하도록 모듈 레벨에서 생성
+reactor_session = create_reactor_session()
+reactor_semaphore = threading.BoundedSemaphore(REACTOR_MAX_CONCURRENCY)
+
+# 얼굴 영역 크롭 모드: 전체 이미지 대신 얼굴 주변만 ReActor로 보내고 결과를 다시 합성
+FACE_SWAP_CROP = os.environ.get('FACE_SWAP_CROP', '0') == '1'
+FACE_CROP_PADDING = float(os.environ.get('FACE_CROP_PADDING', '0.6'))  # 얼굴 박스 크기 대비 여백 비율
+FACE_FEATHER_RATIO = float(os.environ.get('FACE_FEATHER_RATIO', '0.1'))  # 크롭 크기 대비 경계 블렌딩 폭
+
+def send_face_swap_request(source_image_base64, target_image_base64, face_count=1):
     # 이미지 데이터를 Base64로 인코딩하여 JSON으로 전송
+    # 단체 사진이면 소스 i번째 얼굴 -> 타겟 i번째 얼굴로 한 번의 요청에서 모두 스왑
     data = {
         "source_image": source_image_base64,
         "target_image": target_image_base64,
-        "source_faces_index": [0],
-        "face_index": [0],
+        "source_faces_index": list(range(face_count)),
+        "face_index": list(range(face_count)),
         "upscaler": "None",
         "scale": 1,
         "upscale_visibility": 1,
@@ -40,7 +91,18 @@ def send_face_swap_request(source_image_base64, target_image_base64):
         'Content-Type': 'application/json'
     }
 
-    response = requests.post(url, json=data, headers=headers)
+    try:
+        with reactor_semaphore, telemetry.span('reactor') as fields:
+            response = reactor_session.post(
+                REACTOR_URL,
+                json=data,
+                headers=headers,
+                timeout=(REACTOR_CONNECT_TIMEOUT, REACTOR_READ_TIMEOUT)
+            )
+            fields['status_code'] = response.status_code
+    except requests.RequestException as e:
+        print(f"Request to face swap API failed: {e}")
+        return None
 
     if response.status_code == 200:
         print("Request successful")
@@ -50,45 +112,168 @@ def send_face_swap_request(source_image_base64, target_image_base64):
         print("API Error Response:", response.text)
         return None
 
+def detect_target_face(target_image_bytes):
+    # 타겟(Titan 생성 이미지)의 얼굴 박스 검출
+    face_boxes = face_detect.detect_faces(image_bytes=target_image_bytes)
+    return face_boxes[0] if face_boxes else None
+
+def padded_face_region(image_size, box, padding=FACE_CROP_PADDING):
+    # 정규화된 얼굴 박스에 여백을 더해 픽셀 좌표 (left, top, right, bottom)으로 변환
+    image_width, image_height = image_size
+    left = box['Left'] * image_width
+    top = box['Top'] * image_height
+    width = box['Width'] * image_width
+    height = box['Height'] * image_height
+    pad_x = width * padding
+    pad_y = height * padding
+    return (
+        max(0, int(left - pad_x)),
+        max(0, int(top - pad_y)),
+        min(image_width, int(math.ceil(left + width + pad_x))),
+        min(image_height, int(math.ceil(top + height + pad_y)))
+    )
+
+def paste_feathered(image, patch, region, feather_ratio=FACE_FEATHER_RATIO):
+    # 경계가 티나지 않도록 가장자리를 부드럽게 감쇠시킨 마스크로 붙여넣기
+    region_width = region[2] - region[0]
+    region_height = region[3] - region[1]
+    if patch.size != (region_width, region_height):
+        patch = patch.resize((region_width, region_height), Image.LANCZOS)
+
+    feather = max(1, int(min(region_width, region_height) * feather_ratio))
+    mask = Image.new('L', (region_width, region_height), 0)
+    ImageDraw.Draw(mask).rectangle(
+        (feather, feather, region_width - 1 - feather, region_height - 1 - feather),
+        fill=255
+    )
+    mask = mask.filter(ImageFilter.GaussianBlur(feather / 2))
+
+    result = image.copy()
+    result.paste(patch.convert(result.mode), region[:2], mask)
+    return result
+
+def encode_base64_png(image):
+    return base64.b64encode(s3_io.encode_image(image, 'PNG')).decode('utf-8')
+
+def swap_face_regions(source_image_bytes, target_image_bytes, source_face_box):
+    # 얼굴 영역만 잘라서 스왑한 뒤 타겟에 다시 합성, 실패하면 None (전체 이미지 모드로 대체)
+    try:
+        target_face_box = detect_target_face(target_image_bytes)
+    except Exception as e:
+        # 얼굴 검출(Rekognition/OpenCV) 오류도 전체 이미지 모드로 대체
+        print(f"Error detecting target face for crop mode: {e}")
+        return None
+    if source_face_box is None or target_face_box is None:
+        print("Face box not available for crop mode")
+        return None
+
+    source_image = Image.open(io.BytesIO(source_image_bytes))
+    target_image = Image.open(io.BytesIO(target_image_bytes))
+    source_region = padded_face_region(source_image.size, source_face_box)
+    target_region = padded_face_region(target_image.size, target_face_box)
+    print(f"Cropping source to {source_region}, target to {target_region}")
+
+    result = send_face_swap_request(
+        encode_base64_png(source_image.crop(source_region)),
+        encode_base64_png(target_image.crop(target_region))
+    )
+    if not result or 'image' not in result:
+        return None
+
+    swapped_patch = Image.open(io.BytesIO(base64.b64decode(result['image'])))
+    return s3_io.encode_image(paste_feathered(target_image, swapped_patch, target_region), 'PNG')
+
+def count_swappable_faces(source_face_count, target_image_bytes):
+    # 타겟에 생성된 사람 수가 소스보다 적을 수 있으므로 양쪽에 모두 있는 얼굴 수만큼만 스왑
+    try:
+        target_face_count = len(face_detect.detect_faces(image_bytes=target_image_bytes))
+    except Exception as e:
+        # 검출 오류로 스왑 전체가 실패하지 않도록 소스 얼굴 수를 그대로 사용
+        print(f"Error detecting target faces, using source face count: {e}")
+        return source_face_count
+    print(f"Source faces: {source_face_count}, target faces: {target_face_count}")
+    return max(1, min(source_face_count, target_face_count))
+
+def swap_full_images(source_image_bytes, target_image_bytes, face_count=1):
+    # 이미지 데이터를 Base64로 인코딩
+    source_image_base64 = base64.b64encode(source_image_bytes).decode('utf-8')
+    target_image_base64 = base64.b64encode(target_image_bytes).decode('utf-8')
+
+    # API 요청 보내기
+    result = send_face_swap_request(source_image_base64, target_image_base64, face_count)
+    
+    # result 내용을 로그에 출력
+    print("Result from face swap API:", result)
+    
+    if result and 'image' in result:
+        return base64.b64decode(result['image'])
+    return None
+
 def lambda_handler(event, context):
+    # 같은 request_id로 다시 호출되면 ReActor를 다시 부르지 않음
+    telemetry.set_request_id(event['request_id'])
+    ledger_key = idempotency.make_key('swap', event['request_id'])
+    try:
+        return idempotency.run_once(ledger_key, event['request_id'], lambda: swap_faces(event))
+    except Exception:
+        # 마지막 단계이므로 실패하면 내용 해시 기록도 실패로 (같은 사진을 다시 올리면 다시 처리)
+        idempotency.resolve_content(event.get('content_key'), False)
+        raise
+
+def swap_faces(event):
     # 이벤트에서 S3 버킷 이름과 파일 경로 가져오기
     s3_bucket = event['bucket']
     request_id = event['request_id']
+    telemetry.set_request_id(request_id)
 
     source_image_key = f"path/to/{request_id}/source_image.png"
     target_image_key = f"path/to/{request_id}/target.png"
     
     print(f"Using source image key: {source_image_key}")
 
+    # S3에서 소스 이미지와 타겟 이미지를 동시에 다운로드
+    with telemetry.span('download'), ThreadPoolExecutor(max_workers=2) as executor:
+        source_future = executor.submit(s3_io.read_object, s3_bucket, source_image_key)
+        target_future = executor.submit(s3_io.read_bytes, s3_bucket, target_image_key)
+        source_image_bytes, source_metadata = source_future.result()
+        target_image_bytes = target_future.result()
     
-    # S3 클라이언트 생성
-    s3_client = boto3.client('s3')
-    
-    # S3에서 소스 이미지와 타겟 이미지 다운로드
-    source_image_obj = s3_client.get_object(Bucket=s3_bucket, Key=source_image_key)
-    target_image_obj = s3_client.get_object(Bucket=s3_bucket, Key=target_image_key)
+    face_count = int(event.get('face_count') or source_metadata.get('face-count', '1'))
+    if face_count > 1:
+        face_count = count_swappable_faces(face_count, target_image_bytes)
     
-    # 이미지 데이터를 Base64로 인코딩
-    source_image_base64 = base64.b64encode(source_image_obj['Body'].read()).decode('utf-8')
-    target_image_base64 = base64.b64encode(target_image_obj['Body'].read()).decode('utf-8')
-
-    # API 요청 보내기
-    result = send_face_swap_request(source_image_base64, target_image_base64)
+    swapped_image_bytes = None
+    # 크롭 모드는 얼굴 하나만 지원 (단체 사진은 전체 이미지로 한 번에 스왑)
+    if FACE_SWAP_CROP and face_count == 1:
+        # 소스 얼굴 박스는 imgCutting이 source_image.png 메타데이터에 저장한 값을 사용
+        source_face_box = event.get('source_face_box')
+        if source_face_box is None and 'face-box' in source_metadata:
+            source_face_box = json.loads(source_metadata['face-box'])
+        swapped_image_bytes = swap_face_regions(source_image_bytes, target_image_bytes, source_face_box)
+        if swapped_image_bytes is None:
+            print("Face crop mode failed, falling back to full image swap")
     
-    # result 내용을 로그에 출력
-    print("Result from face swap API:", result)
-    
-    if result and 'image' in result:
-        swapped_image_base64 = result['image']
-        swapped_image_bytes = base64.b64decode(swapped_image_base64)
+    if swapped_image_bytes is None:
+        swapped_image_bytes = swap_full_images(source_image_bytes, target_image_bytes, face_count)
     
+    if swapped_image_bytes is not None:
         # S3에 스왑된 이미지 저장
         swapped_image_key = f"path/to/{request_id}/swapped_image.png"
-        s3_client.put_object(Bucket=s3_bucket, Key=swapped_image_key, Body=swapped_image_bytes)
+        # 원본 PNG와 갤러리용 WebP/JPEG(썸네일/미리보기/전체)를 동시에 업로드
+        with telemetry.span('upload_swapped'):
+            web_derivatives.publish(swapped_image_bytes, s3_bucket, swapped_image_key)
     
         print(f"Swapped image saved to S3 at {swapped_image_key}")
+        # 같은 사진을 다시 올리면 이 결과를 재사용
+        idempotency.resolve_content(event.get('content_key'), True)
     else:
         print("No image found in result")
+        idempotency.resolve_content(event.get('content_key'), False)
+        # 200이 아니면 idempotency 기록이 실패로 남아서 재시도 시 다시 스왑
+        return {
+            'statusCode': 502,
+            'body': 'Face swap API returned no image.'
+        }
     
     return {
         'statusCode': 200,
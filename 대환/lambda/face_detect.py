@@ -0,0 +1,106 @@
+import io
+import os
+import boto3
+from PIL import Image, ImageOps
+import s3_io
+
+# 얼굴 검출 백엔드: 'rekognition' (기본) 또는 'opencv' (컨테이너 안에서 CPU로 검출, opencv-python-headless 필요)
+FACE_DETECTOR = os.environ.get('FACE_DETECTOR', 'rekognition')
+
+# OpenCV 백엔드 설정: YuNet ONNX 모델이 없으면 OpenCV 내장 Haar cascade 사용
+YUNET_MODEL_PATH = os.environ.get('YUNET_MODEL_PATH', '/opt/models/face_detection_yunet_2023mar.onnx')
+# Haar cascade XML 경로 (비어 있으면 pip 휠에 포함된 cv2.data 경로 사용)
+HAAR_CASCADE_PATH = os.environ.get('HAAR_CASCADE_PATH', '')
+FACE_SCORE_THRESHOLD = float(os.environ.get('FACE_SCORE_THRESHOLD', '0.8'))
+FACE_DETECT_MAX_EDGE = int(os.environ.get('FACE_DETECT_MAX_EDGE', '640'))  # 검출 전에 이 크기로 축소
+
+def normalize_box(left, top, width, height, image_width, image_height):
+    # Rekognition BoundingBox와 같은 형식 (이미지 크기 대비 0~1 비율)
+    left = min(max(left / image_width, 0.0), 1.0)
+    top = min(max(top / image_height, 0.0), 1.0)
+    return {
+        'Left': left,
+        'Top': top,
+        'Width': min(width / image_width, 1.0 - left),
+        'Height': min(height / image_height, 1.0 - top)
+    }
+
+class RekognitionDetector:
+    name = 'rekognition'
+
+    def __init__(self):
+        self.client = boto3.client('rekognition')
+
+    def detect(self, bucket=None, key=None, image_bytes=None):
+        # 바운딩 박스만 필요하므로 ALL 대신 DEFAULT 속성만 요청
+        if image_bytes is None:
+            image = {'S3Object': {'Bucket': bucket, 'Name': key}}
+        else:
+            image = {'Bytes': image_bytes}
+        response = self.client.detect_faces(Image=image, Attributes=['DEFAULT'])
+        # API 응답 순서는 크기와 무관하므로 OpenCV 백엔드와 같이 큰 얼굴부터 정렬 (MAX_FACES 자르기, 첫 얼굴 박스 선택용)
+        boxes = [face['BoundingBox'] for face in response['FaceDetails']]
+        return sorted(boxes, key=lambda box: box['Width'] * box['Height'], reverse=True)
+
+class OpenCVDetector:
+    name = 'opencv'
+
+    def __init__(self):
+        import cv2
+        self.cv2 = cv2
+        self.yunet = None
+        self.cascade = None
+        if os.path.exists(YUNET_MODEL_PATH):
+            self.yunet = cv2.FaceDetectorYN.create(YUNET_MODEL_PATH, "", (320, 320), FACE_SCORE_THRESHOLD)
+            return
+
+        # cascade XML 경로를 알려주는 cv2.data는 pip 휠(opencv-python*)에만 있음 (배포판 패키지 등은 HAAR_CASCADE_PATH로 지정)
+        cascade_path = HAAR_CASCADE_PATH
+        if not cascade_path and hasattr(cv2, 'data'):
+            cascade_path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        if not cascade_path or not os.path.exists(cascade_path):
+            raise RuntimeError(f"YuNet model not found at {YUNET_MODEL_PATH} and no Haar cascade available (set HAAR_CASCADE_PATH)")
+        print(f"YuNet model not found at {YUNET_MODEL_PATH}, using Haar cascade {cascade_path}")
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+
+    def detect(self, bucket=None, key=None, image_bytes=None):
+        import numpy as np
+
+        if image_bytes is None:
+            image_bytes = s3_io.read_bytes(bucket, key)
+
+        # Rekognition과 같은 좌표계가 되도록 EXIF 회전을 적용한 뒤 축소해서 검출
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert('RGB')
+        image.thumbnail((FACE_DETECT_MAX_EDGE, FACE_DETECT_MAX_EDGE))
+        width, height = image.size
+        image_bgr = np.ascontiguousarray(np.array(image)[:, :, ::-1])
+
+        if self.yunet is not None:
+            self.yunet.setInputSize((width, height))
+            _, faces = self.yunet.detect(image_bgr)
+            rects = [] if faces is None else [face[:4] for face in faces]
+        else:
+            gray = self.cv2.cvtColor(image_bgr, self.cv2.COLOR_BGR2GRAY)
+            rects = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+
+        # 큰 얼굴(주인공일 가능성이 높음)부터 정렬
+        rects = sorted(rects, key=lambda rect: rect[2] * rect[3], reverse=True)
+        return [normalize_box(float(x), float(y), float(w), float(h), width, height) for x, y, w, h in rects]
+
+DETECTORS = {
+    'rekognition': RekognitionDetector,
+    'opencv': OpenCVDetector
+}
+
+detectors = {}
+
+def get_detector(name=FACE_DETECTOR):
+    # 모델 로딩은 컨테이너당 한 번만
+    if name not in detectors:
+        if name not in DETECTORS:
+            raise ValueError(f"Unsupported face detector: {name}")
+        detectors[name] = DETECTORS[name]()
+    return detectors[name]
+
+def detect_faces(bucket=None, key=None, image_bytes=None, detector=FACE_DETECTOR):
+    return get_detector(detector).detect(bucket=bucket, key=key, image_bytes=image_bytes)
@@ -0,0 +1,259 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+import boto3
+from botocore.exceptions import ClientError
+import s3_io
+import telemetry
+
+# 단계별 중복 실행 방지 기록 (S3 이벤트 알림은 at-least-once라 같은 이벤트가 두 번 올 수 있음)
+# 키: 단계 + 입력 식별자 (S3 객체는 bucket/key/ETag, 이후 단계는 request_id)
+# 상태: in_progress -> done | failed, failed이거나 오래된 in_progress는 다시 가져갈 수 있음
+# 백엔드: 'none' | 'file' (한 호스트 내, 로컬 실행용) | 'dynamodb'
+# (batch/gallery_batch.py는 S3 중간 결과로 재개하므로 이 기록을 쓰지 않고 단계 함수를 직접 호출)
+LEDGER_BACKEND = os.environ.get('IDEMPOTENCY_BACKEND', 'none')
+LEDGER_DIR = os.environ.get('IDEMPOTENCY_DIR', '/tmp/idempotency')
+LEDGER_TABLE = os.environ.get('IDEMPOTENCY_TABLE', 'IdempotencyTable')  # 파티션 키: IdempotencyKey (TTL: ExpiresAt)
+LEDGER_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(7 * 24 * 3600)))
+IN_PROGRESS_TIMEOUT_SECONDS = int(os.environ.get('IDEMPOTENCY_IN_PROGRESS_TIMEOUT_SECONDS', '900'))  # Lambda 최대 실행 시간
+
+# 같은 내용의 이미지를 다시 올리면 이전 결과를 재사용 (이미지를 한 번 더 읽어야 하므로 기본은 끔)
+CONTENT_HASH = os.environ.get('IDEMPOTENCY_CONTENT_HASH', '0') == '1'
+CONTENT_TIMEOUT_SECONDS = int(os.environ.get('IDEMPOTENCY_CONTENT_TIMEOUT_SECONDS', '3600'))  # SAM 비동기 추론 최대 시간
+
+def make_key(stage, *parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return f"{stage}/{digest.hexdigest()}"
+
+def object_key(stage, bucket, key, etag):
+    return make_key(stage, bucket, key, etag.strip('"'))
+
+def content_key(data):
+    return make_key('content', data)
+
+def event_object(event):
+    # S3 이벤트의 버킷, 키, ETag (테스트 이벤트처럼 eTag가 없으면 head_object로 조회)
+    record = event['Records'][0]['s3']
+    bucket = record['bucket']['name']
+    key = record['object']['key']
+    etag = record['object'].get('eTag')
+    if etag is None:
+        etag = s3_io.s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+    return bucket, key, etag.strip('"')
+
+def retakable(record, timeout):
+    if record['status'] == 'failed':
+        return True
+    return record['status'] == 'in_progress' and time.time() - record['started_at'] > timeout
+
+class FileLedger:
+    # 로컬 디렉터리에 키마다 JSON 파일 하나, 갱신은 파일 잠금으로 직렬화
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def locked(self):
+        lock_file = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def get(self, key):
+        try:
+            with open(self.path(key), encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        if time.time() > record['expires_at']:
+            return None
+        return record
+
+    def write(self, key, record):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(temp_path, path)
+
+    def begin(self, key, record, timeout):
+        with self.locked():
+            existing = self.get(key)
+            if existing is not None and not retakable(existing, timeout):
+                return existing
+            self.write(key, record)
+            return None
+
+    def finish(self, key, status, result):
+        with self.locked():
+            record = self.get(key)
+            if record is None:
+                return
+            record.update({'status': status, 'result': result})
+            self.write(key, record)
+
+class DynamoDBLedger:
+    # 처음 가져갈 때는 항목이 없을 때만, 다시 가져갈 때는 읽은 시작 시각이 그대로일 때만 쓰는 조건부 쓰기
+    def __init__(self, table):
+        self.table = table
+        self.dynamodb_client = boto3.client('dynamodb')
+
+    @staticmethod
+    def to_record(item):
+        return {
+            'status': item['Status']['S'],
+            'request_id': item['RequestID']['S'],
+            'started_at': float(item['StartedAt']['N']),
+            'expires_at': int(item['ExpiresAt']['N']),
+            'result': item['Result']['S'] if 'Result' in item else None
+        }
+
+    def get(self, key):
+        item = self.dynamodb_client.get_item(
+            TableName=self.table,
+            Key={'IdempotencyKey': {'S': key}},
+            ConsistentRead=True
+        ).get('Item')
+        if item is None or int(item['ExpiresAt']['N']) < time.time():
+            return None
+        return self.to_record(item)
+
+    def put(self, key, record, condition, values=None):
+        kwargs = {'ExpressionAttributeValues': values} if values else {}
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table,
+                Item={
+                    'IdempotencyKey': {'S': key},
+                    'Status': {'S': record['status']},
+                    'RequestID': {'S': record['request_id']},
+                    'StartedAt': {'N': repr(record['started_at'])},
+                    'ExpiresAt': {'N': str(record['expires_at'])}
+                },
+                ConditionExpression=condition,
+                **kwargs
+            )
+            return True
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def begin(self, key, record, timeout):
+        if self.put(key, record, 'attribute_not_exists(IdempotencyKey)'):
+            return None
+        existing = self.get(key)
+        if existing is None:
+            # TTL이 지났지만 아직 삭제되지 않은 항목
+            return None if self.put(key, record, 'ExpiresAt < :now', {':now': {'N': str(int(time.time()))}}) else self.get(key)
+        if not retakable(existing, timeout):
+            return existing
+        if self.put(key, record, 'StartedAt = :started', {':started': {'N': repr(existing['started_at'])}}):
+            return None
+        return self.get(key)
+
+    def finish(self, key, status, result):
+        names = {'#status': 'Status'}
+        values = {':status': {'S': status}}
+        update_expression = 'SET #status = :status'
+        if result is not None:
+            update_expression += ', #result = :result'
+            names['#result'] = 'Result'
+            values[':result'] = {'S': result}
+        self.dynamodb_client.update_item(
+            TableName=self.table,
+            Key={'IdempotencyKey': {'S': key}},
+            UpdateExpression=update_expression,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+def create_backend(name=LEDGER_BACKEND):
+    if name == 'file':
+        return FileLedger(LEDGER_DIR)
+    if name == 'dynamodb':
+        return DynamoDBLedger(LEDGER_TABLE)
+    if name == 'none':
+        return None
+    raise ValueError(f"Unsupported idempotency backend: {name}")
+
+ledger = create_backend()
+
+def is_enabled():
+    return ledger is not None
+
+def begin(key, request_id, timeout=IN_PROGRESS_TIMEOUT_SECONDS):
+    # 실행 권한을 얻으면 None, 이미 끝났거나 다른 실행이 진행 중이면 그 기록을 반환
+    if ledger is None:
+        return None
+    now = time.time()
+    record = {
+        'status': 'in_progress',
+        'request_id': request_id,
+        'started_at': now,
+        'expires_at': int(now) + LEDGER_TTL_SECONDS,
+        'result': None
+    }
+    existing = ledger.begin(key, record, timeout)
+    if existing is not None:
+        telemetry.metric('IdempotentSkip', 1, stage=key.split('/', 1)[0], status=existing['status'])
+        print(f"Skipping duplicate {key}: {existing['status']} by request_id {existing['request_id']}")
+    return existing
+
+def get(key):
+    # 현재 기록 조회 (없거나 만료됐으면 None)
+    if ledger is None:
+        return None
+    return ledger.get(key)
+
+def complete(key, result=None):
+    if ledger is not None:
+        ledger.finish(key, 'done', result)
+
+def fail(key):
+    # 실패로 기록해서 재시도(S3/Lambda 비동기 재시도)가 다시 실행할 수 있도록 함
+    if ledger is not None:
+        ledger.finish(key, 'failed', None)
+
+def resolve_content(content_key, succeeded):
+    # 파이프라인 마지막 단계(faceSwap 또는 실패 처리)에서 내용 해시 기록을 정리
+    # 성공이면 같은 사진을 다시 올렸을 때 결과를 재사용하고, 실패면 다시 처리할 수 있게 함
+    if not content_key:
+        return
+    if succeeded:
+        complete(content_key)
+    else:
+        fail(content_key)
+
+def duplicate_response(record):
+    # 이미 끝났으면 200, 다른 실행이 진행 중이면 202 (순차 모드의 호출자는 200일 때만 다음 단계로 진행)
+    return {
+        'statusCode': 200 if record['status'] == 'done' else 202,
+        'body': json.dumps({'duplicate': True, 'status': record['status'], 'request_id': record['request_id']})
+    }
+
+def run_once(key, request_id, handler, timeout=IN_PROGRESS_TIMEOUT_SECONDS):
+    # handler()가 statusCode 200을 반환해야 완료로 기록, 그 외에는 실패로 기록해서 재시도 허용
+    existing = begin(key, request_id, timeout)
+    if existing is not None:
+        return duplicate_response(existing)
+    try:
+        response = handler()
+    except Exception:
+        fail(key)
+        raise
+    if isinstance(response, dict) and response.get('statusCode') == 200:
+        body = response.get('body')
+        complete(key, body if isinstance(body, str) else None)
+    else:
+        fail(key)
+    return response
@@ -1,14 +1,167 @@
 import json
+import struct
+import zlib
 import boto3
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
 import os
+import s3_io
+import pipeline
+import idempotency
+import telemetry
+import web_derivatives
 
 s3_client = boto3.client('s3')
 lambda_client = boto3.client('lambda')
 dynamodb_client = boto3.client('dynamodb')
 
+# SAM 컨테이너(도커/inference.py)의 압축 마스크 포맷과 동일해야 함
+MASK_MAGIC = b'SAMMASK1'
+READ_CHUNK_SIZE = 1024 * 1024
+
+# 소스 이미지 잘라내기 설정: 마스크 영역 + 여백만 남기고, ReActor는 얼굴 특징만 쓰므로 큰 이미지는 축소
+CUTOUT_PADDING = float(os.environ.get('CUTOUT_PADDING', '0.1'))  # 마스크 영역 크기 대비 여백 비율
+CUTOUT_MAX_EDGE = int(os.environ.get('CUTOUT_MAX_EDGE', '1024'))  # 0이면 축소하지 않음
+
+def read_exact(body, size):
+    data = b''
+    while len(data) < size:
+        chunk = body.read(size - len(data))
+        if not chunk:
+            raise ValueError("Unexpected end of mask data")
+        data += chunk
+    return data
+
+def read_mask_header(body):
+    # SAM 출력의 헤더만 먼저 읽음 (metadata에 요청 정보가 있으면 DynamoDB/입력 JSON 조회 없이 바로 처리 가능)
+    prefix = body.read(len(MASK_MAGIC))
+    if prefix != MASK_MAGIC:
+        # 압축 포맷이 아니면 기존 JSON 포맷으로 처리 (전체를 한 번에 읽음)
+        result = json.loads((prefix + body.read()).decode('utf-8'))
+        return {'format': 'json', 'result': result, 'metadata': result.get('metadata')}
+
+    header_length = struct.unpack('>I', read_exact(body, 4))[0]
+    return json.loads(read_exact(body, header_length).decode('utf-8'))
+
+def read_masks(body, header=None, max_masks=None):
+    if header is None:
+        header = read_mask_header(body)
+    if header.get('format') == 'json':
+        masks = np.array(header['result']['masks'], dtype=bool)
+        masks = masks.reshape(-1, *masks.shape[-2:])
+        return masks if max_masks is None else masks[:max_masks]
+
+    height, width = header['shape'][-2:]
+    mask_count = int(np.prod(header['shape'][:-2]))
+    if max_masks is not None:
+        mask_count = min(mask_count, max_masks)
+
+    # 필요한 마스크 분량만큼만 청크 단위로 읽으면서 압축 해제
+    row_bytes = (width + 7) // 8
+    needed = mask_count * height * row_bytes
+    decompressor = zlib.decompressobj() if header['compression'] == 'zlib' else None
+    packed = bytearray()
+    while len(packed) < needed:
+        chunk = body.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        packed += decompressor.decompress(chunk) if decompressor else chunk
+    if len(packed) < needed:
+        raise ValueError(f"Mask data truncated: expected {needed} bytes, got {len(packed)}")
+
+    bits = np.frombuffer(packed, dtype=np.uint8, count=needed).reshape(mask_count, height, row_bytes)
+    return np.unpackbits(bits, axis=-1, count=width).astype(bool)
+
+def load_original_image(bucket, key):
+    # SAM 컨테이너/Rekognition과 같은 좌표계가 되도록 EXIF 회전을 적용하고 RGB로 통일
+    # (팔레트 PNG의 투명도 등 원래 알파 채널은 SAM 마스크로 대체됨)
+    image = ImageOps.exif_transpose(s3_io.read_image(bucket, key))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+def cut_out(image, mask, padding=CUTOUT_PADDING, max_edge=CUTOUT_MAX_EDGE):
+    # 마스크 영역(+여백)만 잘라서 RGBA 배열을 한 번에 만듦. (잘라낸 이미지, 원본 기준 잘라낸 영역) 반환
+    if mask.shape != (image.height, image.width):
+        print(f"Mask size {mask.shape[::-1]} does not match image size {image.size}, resizing mask")
+        mask = np.array(Image.fromarray(mask).resize(image.size, Image.NEAREST))
+
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        raise ValueError("Mask is empty")
+    mask_left, mask_right = int(cols[0]), int(cols[-1]) + 1
+    mask_top, mask_bottom = int(rows[0]), int(rows[-1]) + 1
+    pad_x = int((mask_right - mask_left) * padding)
+    pad_y = int((mask_bottom - mask_top) * padding)
+    left, right = max(0, mask_left - pad_x), min(image.width, mask_right + pad_x)
+    top, bottom = max(0, mask_top - pad_y), min(image.height, mask_bottom + pad_y)
+
+    # 마스크 밖 픽셀은 (0, 0, 0, 0)으로 (기존 paste 결과와 동일, PNG 압축에도 유리)
+    region_mask = mask[top:bottom, left:right].astype(np.uint8)
+    rgba = np.empty((bottom - top, right - left, 4), dtype=np.uint8)
+    np.multiply(np.asarray(image)[top:bottom, left:right], region_mask[:, :, None], out=rgba[:, :, :3])
+    np.multiply(region_mask, 255, out=rgba[:, :, 3])
+    result_image = Image.fromarray(rgba, 'RGBA')
+
+    if max_edge and max(result_image.size) > max_edge:
+        result_image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return result_image, (left, top, right, bottom)
+
+def crop_box(bounding_box, region, image_size):
+    # 원본 기준 정규화 얼굴 박스를 잘라낸 이미지 기준으로 변환 (정규화 좌표라 축소와는 무관)
+    left, top, right, bottom = region
+    image_width, image_height = image_size
+    box_left = min(max((bounding_box['Left'] * image_width - left) / (right - left), 0.0), 1.0)
+    box_top = min(max((bounding_box['Top'] * image_height - top) / (bottom - top), 0.0), 1.0)
+    return {
+        'Left': box_left,
+        'Top': box_top,
+        'Width': min(bounding_box['Width'] * image_width / (right - left), 1.0 - box_left),
+        'Height': min(bounding_box['Height'] * image_height / (bottom - top), 1.0 - box_top)
+    }
+
+def write_source_image(bucket, request_id, original_image_key, masks, bounding_box, face_count):
+    # 원본 이미지 다운로드
+    original_image = load_original_image(bucket, original_image_key)
+    print(f"Downloaded original image: {original_image_key}")
+    
+    # 마스크 값 대로 이미지 자르기 (여러 얼굴이면 마스크 합집합)
+    with telemetry.span('composite'):
+        result_image, region = cut_out(original_image, masks[:face_count].any(axis=0))
+    print(f"Cut out region {region} from {original_image.size}, result size {result_image.size}")
+    
+    # 최종 이미지 S3에 저장
+    output_key = f'path/to/{request_id}/source_image.png'
+    # faceSwap에서 쓰도록 얼굴 수와 첫 얼굴 박스(잘라낸 이미지 기준 정규화 좌표, 크롭 모드용)를 메타데이터로 함께 저장
+    face_box = crop_box(bounding_box, region, original_image.size)
+    with telemetry.span('upload_source'):
+        web_derivatives.publish(
+            s3_io.encode_image(result_image), bucket, output_key,
+            metadata={'face-box': json.dumps(face_box), 'face-count': str(face_count)},
+            image=result_image, derive=web_derivatives.INTERMEDIATE
+        )
+    return output_key
+
 def lambda_handler(event, context):
+    # request_id는 .out 헤더(또는 DynamoDB 조회)에서 알게 되므로 그 전까지는 비워 둠
+    telemetry.set_request_id(None)
+    if not idempotency.is_enabled():
+        return handle_output(event)
+    try:
+        # 같은 .out 생성 이벤트가 다시 오면 건너뜀 (bucket/key/ETag 기준)
+        bucket, key, etag = idempotency.event_object(event)
+    except Exception as e:
+        print(f"Error reading S3 event: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Error processing image: {str(e)}")
+        }
+    ledger_key = idempotency.object_key('segment', bucket, key, etag)
+    return idempotency.run_once(ledger_key, key.split('/')[-1], lambda: handle_output(event))
+
+def handle_output(event):
+    input_data = None
     try:
         print("Lambda function started")
         
@@ -25,68 +178,82 @@ def lambda_handler(event, context):
                 'body': json.dumps(f"File {key} is not an .out file. Skipping processing.")
             }
         
-        # 출력 UUID 추출
-        output_uuid = key.split('/')[-1].replace('.out', '')
-
-        # DynamoDB에서 RequestID 조회
-        response = dynamodb_client.get_item(
-            TableName='RequestMappingTable',
-            Key={
-                'OutputUUID': {'S': output_uuid}
-            }
-        )
-
-        if 'Item' not in response:
-            print("No matching RequestID found for OutputUUID:", output_uuid)
-            return
+        # .out 파일 헤더 읽기 (요청 정보가 실려 있으면 그대로 사용)
+        with telemetry.span('read_mask_header') as fields:
+            mask_response = s3_client.get_object(Bucket=bucket, Key=key)
+            fields['bytes'] = mask_response.get('ContentLength')
+            header = read_mask_header(mask_response['Body'])
+            input_data = header.get('metadata')
+            if input_data:
+                telemetry.set_request_id(input_data['request_id'])
         
-        request_id = response['Item']['RequestID']['S']
-        print(f"Extracted request_id: {request_id}")
+        if input_data:
+            request_id = input_data['request_id']
+            print(f"Read request metadata from SAM output, request_id: {request_id}")
+        else:
+            # 요청 정보가 없는 출력(이전 버전 컨테이너)은 DynamoDB와 입력 JSON으로 조회
+            # 출력 UUID 추출
+            output_uuid = key.split('/')[-1].replace('.out', '')
+
+            # DynamoDB에서 RequestID 조회
+            with telemetry.span('lookup_request', output_uuid=output_uuid):
+                response = dynamodb_client.get_item(
+                    TableName='RequestMappingTable',
+                    Key={
+                        'OutputUUID': {'S': output_uuid}
+                    }
+                )
+
+            if 'Item' not in response:
+                print("No matching RequestID found for OutputUUID:", output_uuid)
+                return
+            
+            request_id = response['Item']['RequestID']['S']
+            telemetry.set_request_id(request_id)
+            print(f"Extracted request_id: {request_id}")
+            
+            # JSON 파일 내용 읽기
+            response = s3_client.get_object(Bucket=bucket, Key=f'input/{request_id}.json')
+            input_data = json.loads(response['Body'].read().decode('utf-8'))
+            print(f"Read input data: {input_data}")
         
-        # 추출한 request_id를 사용하여 입력 JSON 파일의 키 유추
+        # 추출한 request_id를 사용하여 입력 JSON 파일의 키 유추 (병렬 모드 정리용)
         input_json_key = f'input/{request_id}.json'
-        print(f"Derived input JSON key: {input_json_key}")
-
-        # JSON 파일 내용 읽기
-        response = s3_client.get_object(Bucket=bucket, Key=input_json_key)
-        input_data = json.loads(response['Body'].read().decode('utf-8'))
-        print(f"Read input data: {input_data}")
         
         # 원본 이미지 파일 경로 가져오기
         original_image_key = input_data['key']
         print(f"Original image key: {original_image_key}")
         
-        # .out 파일 내용 읽기 (마스크 값 추출)
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        result = json.loads(response['Body'].read().decode('utf-8'))
-        masks = np.array(result['masks'], dtype=np.uint8) * 255  # numpy 배열을 uint8로 변환하고 값을 0-255 범위로 조정
-        print(f"Read masks: {masks.shape}")
+        # 단체 사진이면 얼굴마다 마스크가 하나씩 옴 (한 얼굴이면 기존처럼 다중 마스크 중 첫 번째 사용)
+        face_count = len(input_data.get('bounding_boxes') or [input_data['bounding_box']])
         
-        # 마스크 배열을 단일 채널로 변환 (첫 번째 채널 사용)
-        mask_image = Image.fromarray(masks[0])
-        
-        # 원본 이미지 다운로드
-        response = s3_client.get_object(Bucket=bucket, Key=original_image_key)
-        original_image = Image.open(response['Body'])
-        print(f"Downloaded original image: {original_image_key}")
-        
-        # 마스크 값 대로 이미지 자르기
-        original_image.putalpha(mask_image)
-        result_image = Image.new("RGBA", original_image.size)
-        result_image.paste(original_image, (0, 0), mask_image)
-        print("Applied mask to original image")
+        # 나머지 마스크 데이터 읽기
+        with telemetry.span('read_masks'):
+            masks = read_masks(mask_response['Body'], header, max_masks=face_count)
+        print(f"Read masks: {masks.shape}")
         
-        # 최종 이미지 S3에 저장
-        output_key = f'path/to/{request_id}/source_image.png'
-        result_image.save('/tmp/result_image.png')
-        s3_client.upload_file('/tmp/result_image.png', bucket, output_key)
+        output_key = write_source_image(bucket, request_id, original_image_key, masks, input_data['bounding_box'], face_count)
         print(f"Final image saved to {output_key}")
         
+        # 병렬 모드: imgMake는 sagemaker-asy에서 이미 시작됨. 소스 완료만 기록하고 join 결과에 맡김
+        if input_data.get('pipeline_mode') == 'parallel':
+            pipeline.complete_stage(
+                bucket, request_id, 'source',
+                cleanup_keys=[input_json_key, key, original_image_key],
+                content_key=input_data.get('content_key')
+            )
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Final image processed and saved, source stage completed.')
+            }
+        
         # imgMake Lambda 함수 호출
         img_make_payload = {
             "bucket": bucket,
             "image_key": original_image_key,  # imgMake 함수에 필요한 데이터를 전달
-            "request_id": request_id
+            "request_id": request_id,
+            "bounding_box": input_data['bounding_box'],
+            "face_count": face_count
         }
 
         img_make_response = lambda_client.invoke(
@@ -104,7 +271,8 @@ def lambda_handler(event, context):
             # faceSwap Lambda 함수 호출
             face_swap_payload = {
                 "bucket": bucket,
-                "request_id": request_id
+                "request_id": request_id,
+                "content_key": input_data.get('content_key')
             }
 
             face_swap_response = lambda_client.invoke(
@@ -118,18 +286,10 @@ def lambda_handler(event, context):
             print(f"Response from faceSwap Lambda: {face_swap_response_payload}")
         else:
             print("imgMake Lambda function failed, skipping faceSwap Lambda invocation.")
+            idempotency.resolve_content(input_data.get('content_key'), False)
         
-        # input 폴더의 JSON 파일 삭제
-        s3_client.delete_object(Bucket=bucket, Key=input_json_key)
-        print(f"Deleted input JSON file: {input_json_key}")
-        
-        # /succ 폴더 내 .out 파일 삭제하기
-        s3_client.delete_object(Bucket=bucket, Key=key)
-        print(f"Deleted .out file from succ folder: {key}")
-        
-        # /upload에 존재하는 원본 이미지 삭제하기
-        s3_client.delete_object(Bucket=bucket, Key=original_image_key)
-        print(f"Deleted original image from upload folder: {original_image_key}")
+        # input 폴더의 JSON 파일, /succ 폴더 내 .out 파일, /upload의 원본 이미지를 동시에 삭제
+        pipeline.delete_objects(bucket, [input_json_key, key, original_image_key])
         
         return {
             'statusCode': 200,
@@ -137,6 +297,16 @@ def lambda_handler(event, context):
         }
     except Exception as e:
         print(f"Error processing {key} from bucket {bucket}. Error: {str(e)}")
+        # 병렬 모드: 소스 단계 실패를 기록해서 imgMake 쪽 join이 정리 작업과 실패 상태 기록을 하도록 함
+        if input_data and input_data.get('pipeline_mode') == 'parallel':
+            pipeline.complete_stage(
+                bucket, input_data['request_id'], 'source',
+                cleanup_keys=[f"input/{input_data['request_id']}.json", key, input_data['key']],
+                error=str(e),
+                content_key=input_data.get('content_key')
+            )
+        elif input_data:
+            idempotency.resolve_content(input_data.get('content_key'), False)
         return {
             'statusCode': 500,
             'body': json.dumps(f"Error processing image: {str(e)}")
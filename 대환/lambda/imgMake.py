@@ -3,31 +3,65 @@ import boto3
 import json
 import os
 import io
-from PIL import Image
+from PIL import Image, ImageOps
 from botocore.exceptions import ClientError
 import random
+import hashlib
+import re
+import threading
+import s3_io
+import pipeline
+import bedrock_cache
+import target_pool
+import idempotency
+import telemetry
+import web_derivatives
 
 # AWS 서비스 클라이언트 설정
 bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
-s3 = boto3.client('s3')
 
 # Claude 모델 ID
 MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
 
+# Claude 입력 이미지 전처리 설정
+CLAUDE_IMAGE_MAX_EDGE = int(os.environ.get('CLAUDE_IMAGE_MAX_EDGE', '1568'))  # 모델이 이보다 큰 이미지는 어차피 축소해서 사용
+CLAUDE_IMAGE_MAX_BYTES = int(os.environ.get('CLAUDE_IMAGE_MAX_BYTES', str(1024 * 1024)))
+CLAUDE_IMAGE_FORMAT = os.environ.get('CLAUDE_IMAGE_FORMAT', 'JPEG')  # 'JPEG' 또는 'WEBP'
+CLAUDE_IMAGE_QUALITY = int(os.environ.get('CLAUDE_IMAGE_QUALITY', '85'))
+CLAUDE_IMAGE_MIN_QUALITY = 40
+CLAUDE_FACE_CROP = os.environ.get('CLAUDE_FACE_CROP', '0') == '1'
+CLAUDE_FACE_CROP_PADDING = float(os.environ.get('CLAUDE_FACE_CROP_PADDING', '1.0'))  # 얼굴 박스 대비 여백 (헤어스타일이 보이도록 넉넉하게)
+
+# 타겟 이미지의 직업 (이벤트에 profession이 없을 때)
+DEFAULT_PROFESSION = os.environ.get('DEFAULT_PROFESSION', 'firefighter')
+
+# Claude 응답 스트리밍 설정
+# 응답 앞부분의 인물 특징(헤어스타일/성별/피부색)만 Titan 프롬프트에 쓰므로, 특징이 다 오면 바로 다음 단계로 진행
+CLAUDE_STREAM = os.environ.get('CLAUDE_STREAM', '1') == '1'
+CLAUDE_KEEP_STORY = os.environ.get('CLAUDE_KEEP_STORY', '0') == '1'  # 1이면 특징 이후의 이야기도 Titan 생성과 동시에 끝까지 받음
+ATTRIBUTE_FIELDS = ('Hairstyle', 'Gender', 'Skin tone')
+STORY_SEPARATOR = '###'
+ATTRIBUTE_PATTERN = re.compile(r'^[ \t*\-]*(hairstyle|gender|skin tone)[ \t*]*:[ \t*]*(.+?)[ \t*]*$', re.IGNORECASE | re.MULTILINE)
+
 # 사용자 정의 예외 클래스
 class ImageError(Exception):
     def __init__(self, message):
         self.message = message
 
-def call_claude_haiku(base64_string, name, hope):
+def build_claude_request(base64_string, name, hope, media_type="image/jpeg"):
+    # 스트리밍 중에 먼저 끝낼 수 있도록 인물 특징을 정해진 형식으로 가장 먼저 출력하게 함
     prompt = f"""이미지 속 인물은 {hope}입니다. 이미지를 분석하고 가상의 인생 스토리를 만들어주세요.
         1. 특정 개인을 식별하지 마세요. 주인공은 가상의 인물이어야 합니다.
-        2. 이야기는 "당신은..."으로 시작하세요.
-        3. 이야기의 길이는 150자 이내로 제한하세요.
-        4. 이미지 속 인물 {name}의 직업에 대한 재미있는 일화를 만들어주세요.
-        5. 마지막에 '*'를 쓰고 '헤어스타일', '성별', '피부색'을 상세히 적어주세요.
-        6. 인물의 어린 시절 이야기는 포함하지 마세요.
-        7. 반드시 영어로 출력하세요.
+        2. 가장 먼저 아래 세 줄을 마크다운 없이 이 형식 그대로 상세히 적어주세요.
+        Hairstyle: (헤어스타일)
+        Gender: (성별)
+        Skin tone: (피부색)
+        3. 그 다음 줄에 '{STORY_SEPARATOR}'만 쓰고, 이어서 이야기를 쓰세요.
+        4. 이야기는 "당신은..."으로 시작하세요.
+        5. 이야기의 길이는 150자 이내로 제한하세요.
+        6. 이미지 속 인물 {name}의 직업에 대한 재미있는 일화를 만들어주세요.
+        7. 인물의 어린 시절 이야기는 포함하지 마세요.
+        8. 반드시 영어로 출력하세요.
         """
 
     prompt_config = {
@@ -41,7 +75,7 @@ def call_claude_haiku(base64_string, name, hope):
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/jpeg",
+                            "media_type": media_type,
                             "data": base64_string,
                         },
                     },
@@ -51,37 +85,143 @@ def call_claude_haiku(base64_string, name, hope):
         ],
     }
 
-    body = json.dumps(prompt_config)
+    return json.dumps(prompt_config)
 
-    response = bedrock.invoke_model(
-        body=body, modelId=MODEL_ID, accept="application/json", contentType="application/json"
-    )
-    response_body = json.loads(response.get("body").read())
+def call_claude_haiku(body):
+    response_body = json.loads(bedrock_cache.invoke_model(bedrock, 'claude', MODEL_ID, body))
 
     results = response_body.get("content")[0].get("text")
     return results
 
-def generate_text_from_image(image_file, name="신준혁", hope="소방관"):
-    base64_image = base64.b64encode(image_file).decode('utf-8')
+def parse_attributes(text):
+    # "Hairstyle: ..." 형식의 줄에서 인물 특징 추출 (앞뒤 마크다운 기호는 무시)
+    attributes = {}
+    for name, value in ATTRIBUTE_PATTERN.findall(text):
+        field = next(field for field in ATTRIBUTE_FIELDS if field.lower() == name.lower())
+        attributes.setdefault(field, value)
+    return attributes
+
+def attributes_complete(text):
+    # 마지막 줄은 아직 받는 중일 수 있으므로 줄바꿈으로 끝난 줄까지만 확인
+    finished_lines = text[:text.rfind('\n') + 1]
+    return STORY_SEPARATOR in text or all(field in parse_attributes(finished_lines) for field in ATTRIBUTE_FIELDS)
+
+def split_story(text):
+    return text.split(STORY_SEPARATOR, 1)[1].strip() if STORY_SEPARATOR in text else ''
+
+def iter_stream_text(stream):
+    # invoke_model_with_response_stream 이벤트에서 텍스트 조각만 꺼냄
+    for event in stream:
+        chunk = json.loads(event['chunk']['bytes'])
+        if chunk.get('type') == 'content_block_delta':
+            yield chunk['delta'].get('text', '')
+
+# 조기 종료해서 특징 부분까지만 받은 응답은 전체 응답('claude')과 다른 네임스페이스에 캐시
+# (이야기가 필요한 호출이 빈 이야기를 캐시에서 받지 않도록)
+PARTIAL_CACHE_NAMESPACE = 'claude-attributes'
+
+def cache_text(namespace, body, text):
+    # 스트리밍 결과도 invoke_model 응답과 같은 형식으로 캐시
+    bedrock_cache.store(namespace, MODEL_ID, body, json.dumps({'content': [{'type': 'text', 'text': text}]}).encode('utf-8'))
+
+def stream_claude(body, keep_story=CLAUDE_KEEP_STORY):
+    # (특징, 이야기를 기다리는 함수) 반환. 특징이 다 오면 바로 반환해서 Titan 생성을 먼저 시작할 수 있게 함
+    # 전체 응답은 항상 사용할 수 있고, 특징만 있는 응답은 이야기가 필요 없을 때만 사용
+    namespaces = ('claude',) if keep_story else ('claude', PARTIAL_CACHE_NAMESPACE)
+    for namespace in namespaces:
+        cached = bedrock_cache.lookup(namespace, MODEL_ID, body)
+        if cached is not None:
+            text = json.loads(cached)['content'][0]['text']
+            return parse_attributes(text), lambda: split_story(text)
+
+    with telemetry.span('bedrock_invoke', namespace='claude', model_id=MODEL_ID, stream=True) as fields:
+        response = bedrock.invoke_model_with_response_stream(
+            body=body, modelId=MODEL_ID, accept="application/json", contentType="application/json"
+        )
+        stream = response['body']
+        deltas = iter_stream_text(stream)
+        text = ''
+        for delta in deltas:
+            text += delta
+            if attributes_complete(text):
+                break
+        fields['attribute_chars'] = len(text)
+    attributes = parse_attributes(text)
+
+    if not keep_story:
+        # 나머지(이야기)는 쓰지 않으므로 더 받지 않고 연결 종료
+        stream.close()
+        cache_text(PARTIAL_CACHE_NAMESPACE, body, text)
+        return attributes, lambda: split_story(text)
+
+    # 이야기 뒷부분은 백그라운드에서 계속 받음 (Lambda가 끝나기 전에 반드시 기다려야 함)
+    result = {'text': text}
+
+    def read_rest():
+        try:
+            for delta in deltas:
+                result['text'] += delta
+            cache_text('claude', body, result['text'])
+        except Exception as e:
+            print(f"Error reading Claude story stream: {e}")
+
+    reader = threading.Thread(target=read_rest, daemon=True)
+    reader.start()
+
+    def wait_story():
+        reader.join()
+        return split_story(result['text'])
+
+    return attributes, wait_story
+
+def crop_to_face(image, bounding_box, padding=CLAUDE_FACE_CROP_PADDING):
+    # Rekognition 박스는 EXIF 회전이 적용된 좌표 기준
+    width, height = image.size
+    left = (bounding_box['Left'] - bounding_box['Width'] * padding) * width
+    top = (bounding_box['Top'] - bounding_box['Height'] * padding) * height
+    right = (bounding_box['Left'] + bounding_box['Width'] * (1 + padding)) * width
+    bottom = (bounding_box['Top'] + bounding_box['Height'] * (1 + padding)) * height
+    return image.crop((max(0, int(left)), max(0, int(top)), min(width, int(right)), min(height, int(bottom))))
+
+def prepare_image_for_claude(image_file, bounding_box=None):
+    # 한 번만 디코딩해서 회전 보정, (선택) 얼굴 크롭, 축소 후 용량 제한 안에서 다시 인코딩
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_file)))
+    if CLAUDE_FACE_CROP and bounding_box:
+        image = crop_to_face(image, bounding_box)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((CLAUDE_IMAGE_MAX_EDGE, CLAUDE_IMAGE_MAX_EDGE), Image.LANCZOS)
+
+    quality = CLAUDE_IMAGE_QUALITY
+    while True:
+        image_bytes = s3_io.encode_image(image, CLAUDE_IMAGE_FORMAT, quality=quality)
+        if len(image_bytes) <= CLAUDE_IMAGE_MAX_BYTES or quality <= CLAUDE_IMAGE_MIN_QUALITY:
+            break
+        quality = max(CLAUDE_IMAGE_MIN_QUALITY, quality - 15)
+
+    print(f"Prepared image for Claude: {image.size}, {len(image_bytes)} bytes (from {len(image_file)}), quality {quality}")
+    return image_bytes, Image.MIME[CLAUDE_IMAGE_FORMAT.upper()]
+
+def generate_attributes_from_image(image_file, name="신준혁", hope="소방관", bounding_box=None):
+    image_bytes, media_type = prepare_image_for_claude(image_file, bounding_box)
+    base64_image = base64.b64encode(image_bytes).decode('utf-8')
     print("Base64 Image Length:", len(base64_image))
     
-    text_result = call_claude_haiku(base64_image, name, hope)
-    return text_result
+    body = build_claude_request(base64_image, name, hope, media_type)
+    if CLAUDE_STREAM:
+        return stream_claude(body)
+    text_result = call_claude_haiku(body)
+    return parse_attributes(text_result), lambda: split_story(text_result)
 
 def generate_image(body):
     model_id = 'amazon.titan-image-generator-v2:0'
-    accept = "application/json"
-    content_type = "application/json"
 
     try:
-        response = bedrock.invoke_model(
-            body=body,
-            modelId=model_id,
-            accept=accept,
-            contentType=content_type
-        )
-
-        response_body = json.loads(response.get("body").read())
+        # 오류 응답은 캐시하지 않음
+        response_body = json.loads(bedrock_cache.invoke_model(
+            bedrock, 'titan', model_id, body,
+            cacheable=lambda data: not json.loads(data).get("error")
+        ))
         base64_image = response_body.get("images")[0]
         image_bytes = base64.b64decode(base64_image.encode('ascii'))
 
@@ -94,23 +234,21 @@ def generate_image(body):
         print(f"ClientError: {err.response['Error']['Message']}")
         raise
 
-def lambda_handler(event, context):
-    try:
-        # Lambda 함수가 imgCutting 함수에서 호출되었을 때의 이벤트 데이터 처리
-        bucket_name = event['bucket']
-        object_key = event['image_key']  # imgCutting 함수에서 전달된 이미지 키 사용
-        request_id = event['request_id']
-
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        image_data = response['Body'].read()
-
-        generated_text = generate_text_from_image(image_data)
-        generated_text_parts = generated_text.split("*")
-        hairstyle = generated_text_parts[1] if len(generated_text_parts) > 1 else "Unknown"
-        print(f"Extracted hairstyle: {hairstyle}")
-
-        future_dream = "firefighter"
-        random_seed = random.randint(0, 214783647)
+def build_titan_body(hairstyle, future_dream, face_count=1, seed=None):
+    if seed is None:
+        seed = random.randint(0, 214783647)
+    if face_count > 1:
+        # 단체 사진: faceSwap이 얼굴을 하나씩 대응시킬 수 있도록 같은 수의 사람이 정면으로 보이게 생성
+        prompt = f"""
+            A group of exactly {face_count} people standing side by side.
+            A characteristic of the main person is {hairstyle}.
+            People dedicatedly working together as {future_dream}s.
+            A background that matches their {future_dream},
+            with a detailed background.
+            Everyone looking at viewer, every face fully visible and not overlapping.
+            Allowing the background to be an important element of the composition.
+        """
+    else:
         prompt = f"""
             A characteristic of person is {hairstyle}.
             A person dedicatedly working on their {future_dream}.
@@ -121,45 +259,97 @@ def lambda_handler(event, context):
             A Whole Face.
         """
 
-        body = json.dumps({
-            "taskType": "TEXT_IMAGE",
-            "textToImageParams": {
-                "text": prompt
-            },
-            "imageGenerationConfig": {
-                "numberOfImages": 1,
-                "height": 1024,
-                "width": 1024,
-                "cfgScale": 9.0,
-                "seed": random_seed
-            }
-        })
+    return json.dumps({
+        "taskType": "TEXT_IMAGE",
+        "textToImageParams": {
+            "text": prompt
+        },
+        "imageGenerationConfig": {
+            "numberOfImages": 1,
+            "height": 1024,
+            "width": 1024,
+            "cfgScale": 9.0,
+            "seed": seed
+        }
+    })
 
-        image_bytes = generate_image(body=body)
-        image = Image.open(io.BytesIO(image_bytes))
+def finish_target(event, bucket_name, request_id, destination_key, wait_story):
+    print(f"Image successfully processed and uploaded to {destination_key}")
+    
+    # 이야기를 계속 받는 중이면 Lambda가 끝나기 전에 마무리
+    print(f"Generated story: {wait_story()}")
+    
+    # 병렬 모드로 호출된 경우 타겟 완료를 기록 (소스도 준비되어 있으면 faceSwap 시작)
+    if event.get('join'):
+        pipeline.complete_stage(bucket_name, request_id, 'target', content_key=event.get('content_key'))
+    return {
+        'statusCode': 200,
+        'body': json.dumps('Image processed and uploaded successfully')
+    }
 
-        # 처리된 이미지를 S3에 저장
+def lambda_handler(event, context):
+    # 같은 request_id로 다시 호출되면(비동기 호출 재시도, 중복 join) 건너뜀
+    telemetry.set_request_id(event['request_id'])
+    ledger_key = idempotency.make_key('target', event['request_id'])
+    return idempotency.run_once(ledger_key, event['request_id'], lambda: make_target(event))
+
+def make_target(event):
+    try:
+        # Lambda 함수가 imgCutting 함수에서 호출되었을 때의 이벤트 데이터 처리
+        bucket_name = event['bucket']
+        object_key = event['image_key']  # imgCutting 함수에서 전달된 이미지 키 사용
+        request_id = event['request_id']
+        telemetry.set_request_id(request_id)
+
+        image_data = s3_io.read_bytes(bucket_name, object_key)
+
+        with telemetry.span('claude'):
+            attributes, wait_story = generate_attributes_from_image(image_data, bounding_box=event.get('bounding_box'))
+        hairstyle = ", ".join(f"{field}: {attributes[field]}" for field in ATTRIBUTE_FIELDS if field in attributes) or "Unknown"
+        print(f"Extracted attributes: {attributes}")
+
+        future_dream = event.get('profession', DEFAULT_PROFESSION)
+        face_count = event.get('face_count', 1)
         destination_key = f'path/to/{request_id}/target.png'  # 이미지 이름을 명확하게 target.png로 설정
-        upload_image_to_s3(image, bucket_name, destination_key)
 
-        print(f"Image successfully processed and uploaded to {destination_key}")
-        return {
-            'statusCode': 200,
-            'body': json.dumps('Image processed and uploaded successfully')
-        }
+        # 미리 생성해 둔 풀에 비슷한 특징의 이미지가 있으면 Titan 호출 없이 바로 사용
+        if target_pool.ENABLED:
+            pool_key = target_pool.pool_key(future_dream, target_pool.normalize_attributes(attributes), face_count)
+            with telemetry.span('target_pool_take', pool_key=pool_key):
+                taken = target_pool.take(bucket_name, pool_key, destination_key)
+            target_pool.request_replenish(bucket_name, pool_key, taken)
+            if taken:
+                return finish_target(event, bucket_name, request_id, destination_key, wait_story)
+
+        if bedrock_cache.is_enabled():
+            # 캐시를 쓸 때는 같은 사진이 다시 처리되면 같은 Titan 요청이 되도록 이미지 해시로 seed 고정
+            random_seed = int(hashlib.sha256(image_data).hexdigest()[:8], 16) % 214783647
+        else:
+            random_seed = random.randint(0, 214783647)
+        body = build_titan_body(hairstyle, future_dream, face_count, random_seed)
+
+        with telemetry.span('titan'):
+            image_bytes = generate_image(body=body)
+        image = Image.open(io.BytesIO(image_bytes))
+
+        # 처리된 이미지를 S3에 저장 (Titan 응답이 PNG이므로 다시 인코딩하지 않고 그대로 업로드)
+        with telemetry.span('upload_target'):
+            web_derivatives.publish(
+                image_bytes, bucket_name, destination_key,
+                image=image, derive=web_derivatives.INTERMEDIATE
+            )
+
+        return finish_target(event, bucket_name, request_id, destination_key, wait_story)
 
     except Exception as e:
         print(f"Error: {e}")
+        # 병렬 모드: 실패도 기록해야 join이 끝나서 남은 입력 파일이 정리되고 실패 상태가 남음
+        if event.get('join'):
+            pipeline.complete_stage(
+                event['bucket'], event['request_id'], 'target',
+                error=str(e), content_key=event.get('content_key')
+            )
         return {
             'statusCode': 500,
             'body': json.dumps(f"Error processing image: {e}")
         }
-
-def upload_image_to_s3(image, bucket_name, file_key):
-    # 이미지를 바이트 스트림으로 변환
-    image_bytes = io.BytesIO()
-    image.save(image_bytes, format='PNG')
-    image_bytes = image_bytes.getvalue()
-
-    # S3에 이미지 업로드
-    s3.put_object(Bucket=bucket_name, Key=file_key, Body=image_bytes, ContentType='image/png')
@@ -0,0 +1,102 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+import idempotency
+
+# 파이프라인 실행 방식
+# 'sequential': imgCutting이 imgMake → faceSwap을 차례로 동기 호출 (기존 방식)
+# 'parallel': sagemaker-asy가 SAM과 동시에 imgMake를 시작하고, 두 결과가 모두 준비되면 faceSwap 호출
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'sequential')
+
+# request_id별 단계 완료 여부를 기록하는 DynamoDB 테이블 (파티션 키: RequestID)
+JOIN_TABLE = os.environ.get('PIPELINE_JOIN_TABLE', 'PipelineJoinTable')
+JOIN_STAGES = ('source', 'target')
+
+lambda_client = boto3.client('lambda')
+dynamodb_client = boto3.client('dynamodb')
+s3_client = boto3.client('s3')
+
+def invoke_async(function_name, payload):
+    # 응답을 기다리지 않는 비동기 호출
+    lambda_client.invoke(
+        FunctionName=function_name,
+        InvocationType='Event',
+        Payload=json.dumps(payload)
+    )
+    print(f"Invoked {function_name} asynchronously for request_id: {payload.get('request_id')}")
+
+def delete_objects(bucket, keys):
+    # 정리할 S3 객체들을 동시에 삭제
+    keys = [key for key in keys if key]
+    if not keys:
+        return
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        list(executor.map(lambda key: s3_client.delete_object(Bucket=bucket, Key=key), keys))
+    print(f"Deleted objects: {keys}")
+
+def claim_finish(request_id):
+    # 중복 호출을 막기 위해 마지막 처리(faceSwap 시작 또는 실패 정리) 권한을 한 번만 획득
+    try:
+        dynamodb_client.update_item(
+            TableName=JOIN_TABLE,
+            Key={'RequestID': {'S': request_id}},
+            UpdateExpression='SET SwapTriggered = :true',
+            ConditionExpression='attribute_not_exists(SwapTriggered)',
+            ExpressionAttributeValues={':true': {'BOOL': True}}
+        )
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def complete_stage(bucket, request_id, stage, cleanup_keys=(), error=None, content_key=None):
+    # 단계 종료를 기록하고, 마지막으로 끝난 단계가 faceSwap 호출과 정리 작업을 담당 (request_id로 join)
+    # error가 있으면 실패로 기록: 모든 단계가 끝나면 faceSwap 없이 정리만 하고 PipelineStatus를 failed로 남김
+    # content_key: 내용 해시 기록 키 (faceSwap에 넘기거나, 실패하면 여기서 실패로 기록)
+    update_expression = 'ADD CompletedStages :stage'
+    values = {':stage': {'SS': [stage]}}
+    if cleanup_keys:
+        update_expression += ', CleanupKeys :keys'
+        values[':keys'] = {'SS': list(cleanup_keys)}
+    if error is not None:
+        update_expression += ', FailedStages :stage'
+    assignments = []
+    if error is not None:
+        assignments.append('PipelineStatus = :failed, ErrorMessage = :error')
+        values[':failed'] = {'S': 'failed'}
+        values[':error'] = {'S': f"{stage}: {error}"}
+    if content_key:
+        assignments.append('ContentKey = :content_key')
+        values[':content_key'] = {'S': content_key}
+    if assignments:
+        update_expression += ' SET ' + ', '.join(assignments)
+
+    response = dynamodb_client.update_item(
+        TableName=JOIN_TABLE,
+        Key={'RequestID': {'S': request_id}},
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    item = response['Attributes']
+    completed = set(item['CompletedStages']['SS'])
+    if not completed.issuperset(JOIN_STAGES):
+        print(f"Stage {stage} {'failed' if error is not None else 'done'} for {request_id}, waiting for {set(JOIN_STAGES) - completed}")
+        return False
+
+    if not claim_finish(request_id):
+        print(f"Pipeline already finished for {request_id}")
+        return False
+
+    failed_stages = item.get('FailedStages', {}).get('SS', [])
+    content_key = item.get('ContentKey', {}).get('S')
+    if failed_stages:
+        print(f"Pipeline failed for {request_id} at {failed_stages}, skipping faceSwap")
+        idempotency.resolve_content(content_key, False)
+    else:
+        invoke_async('faceSwap', {'bucket': bucket, 'request_id': request_id, 'content_key': content_key})
+    delete_objects(bucket, item.get('CleanupKeys', {}).get('SS', []))
+    return not failed_stages
@@ -0,0 +1,55 @@
+import json
+import random
+import imgMake
+import target_pool
+import telemetry
+
+# 타겟 이미지 풀 보충 Lambda
+# imgMake가 풀에서 이미지를 꺼낼 때 비동기로 호출({'bucket', 'pool_key', 'target'}, 보충 점유는 호출한 쪽이 획득),
+# 또는 EventBridge 스케줄로 호출({'bucket'} -> 모든 풀 키를 CAPACITY까지 보충)
+def generate_for(key):
+    profession, normalized, face_count = target_pool.parse_key(key)
+    hairstyle = target_pool.describe(normalized)
+
+    def generate():
+        # 같은 풀 키 안에서도 서로 다른 이미지가 되도록 생성할 때마다 seed를 새로 뽑음
+        # Titan 응답이 PNG이므로 다시 인코딩하지 않고 그대로 저장
+        body = imgMake.build_titan_body(hairstyle, profession, face_count, random.randint(0, 214783647))
+        return imgMake.generate_image(body=body)
+    return generate
+
+def replenish_leased(bucket_name, key, target=target_pool.CAPACITY):
+    try:
+        return target_pool.replenish(bucket_name, key, generate_for(key), target)
+    finally:
+        target_pool.release_lease(key)
+
+def lambda_handler(event, context):
+    # 특정 요청에 속하지 않는 작업이므로 이전 요청의 request_id가 붙지 않도록 비움
+    telemetry.set_request_id(None)
+    try:
+        bucket_name = event['bucket']
+
+        generated = {}
+        if event.get('pool_key'):
+            generated[event['pool_key']] = replenish_leased(
+                bucket_name, event['pool_key'], event.get('target', target_pool.CAPACITY)
+            )
+        else:
+            for key in target_pool.list_keys(bucket_name):
+                if target_pool.acquire_lease(key):
+                    generated[key] = replenish_leased(bucket_name, key)
+                else:
+                    print(f"Pool {key} is already being replenished")
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'generated': generated})
+        }
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Error replenishing target pool: {e}")
+        }
@@ -0,0 +1,60 @@
+import io
+import os
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from PIL import Image
+import telemetry
+
+# /tmp를 거치지 않는 S3 읽기/쓰기 공용 모듈 (imgCutting, imgMake, faceSwap에서 사용)
+s3_client = boto3.client('s3')
+
+# 이 크기 이상이면 멀티파트 업로드 사용
+MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+transfer_config = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_THRESHOLD
+)
+
+def read_bytes(bucket, key):
+    return read_object(bucket, key)[0]
+
+def read_object(bucket, key):
+    # 본문과 사용자 메타데이터(x-amz-meta-*)를 함께 반환
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    data = response['Body'].read()
+    telemetry.metric('S3BytesIn', len(data), unit='Bytes', key=key)
+    return data, response.get('Metadata', {})
+
+def object_exists(bucket, key):
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+def read_image(bucket, key):
+    # S3 본문을 메모리에서 바로 PIL 이미지로 디코딩
+    image = Image.open(io.BytesIO(read_bytes(bucket, key)))
+    image.load()
+    return image
+
+def upload_bytes(data, bucket, key, content_type=None, metadata=None, cache_control=None):
+    extra_args = {'ContentType': content_type} if content_type else {}
+    if metadata:
+        extra_args['Metadata'] = metadata
+    if cache_control:
+        extra_args['CacheControl'] = cache_control
+    if len(data) >= MULTIPART_THRESHOLD:
+        s3_client.upload_fileobj(io.BytesIO(data), bucket, key, ExtraArgs=extra_args, Config=transfer_config)
+    else:
+        s3_client.put_object(Bucket=bucket, Key=key, Body=data, **extra_args)
+    telemetry.metric('S3BytesOut', len(data), unit='Bytes', key=key)
+    return len(data)
+
+def encode_image(image, format='PNG', **save_options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **save_options)
+    return buffer.getvalue()
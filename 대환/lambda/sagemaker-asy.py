@@ -1,19 +1,85 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import uuid
 from datetime import datetime
+import pipeline
+import face_detect
+import idempotency
+import s3_io
+import telemetry
+import web_derivatives
+
+# 단체 사진에서 한 번에 처리할 최대 얼굴 수 (큰 얼굴부터)
+MAX_FACES = int(os.environ.get('MAX_FACES', '8'))
 
 # AWS 클라이언트 생성
 sagemaker_runtime_client = boto3.client('sagemaker-runtime')
 s3_client = boto3.client('s3')
-rekognition_client = boto3.client('rekognition')
+
+def make_request_id():
+    microseconds = int(datetime.now().strftime("%f"))
+    milliseconds = microseconds // 1000
+    current_time_ms_str = datetime.now().strftime("%Y%m%d%H%M%S") + "{:03d}".format(milliseconds)
+    return f"{current_time_ms_str}-{uuid.uuid4()}"
+
+def copy_object(bucket, source_key, destination_key):
+    # 메타데이터(Content-Type, Cache-Control)는 서버 측 복사에서 그대로 유지됨
+    s3_client.copy_object(Bucket=bucket, Key=destination_key, CopySource={'Bucket': bucket, 'Key': source_key})
+
+def copy_web_derivatives(bucket, previous_key, swapped_image_key):
+    # 이전 결과의 갤러리용 변형(WebP/JPEG)과 목록(manifest)도 새 경로로 복사
+    previous_manifest_key = web_derivatives.manifest_key(previous_key)
+    if not s3_io.object_exists(bucket, previous_manifest_key):
+        return
+    manifest = json.loads(s3_io.read_bytes(bucket, previous_manifest_key))
+    previous_prefix = previous_key.rsplit('/', 1)[0] + '/'
+    prefix = swapped_image_key.rsplit('/', 1)[0] + '/'
+    copies = []
+    for entry in manifest['variants'].values():
+        for format_name in web_derivatives.FORMAT_INFO:
+            if format_name in entry and entry[format_name].startswith(previous_prefix):
+                variant_key = prefix + entry[format_name][len(previous_prefix):]
+                # 같은 변형을 가리키는 항목(작은 원본의 미리보기 등)은 한 번만 복사
+                if (entry[format_name], variant_key) not in copies:
+                    copies.append((entry[format_name], variant_key))
+                entry[format_name] = variant_key
+    manifest['original'] = swapped_image_key
+    with ThreadPoolExecutor(max_workers=web_derivatives.UPLOAD_CONCURRENCY) as executor:
+        list(executor.map(lambda copy: copy_object(bucket, *copy), copies))
+    s3_io.upload_bytes(
+        json.dumps(manifest).encode('utf-8'), bucket, web_derivatives.manifest_key(swapped_image_key),
+        content_type='application/json', cache_control=web_derivatives.CACHE_CONTROL
+    )
+
+def reuse_result(bucket, key, request_id, record):
+    # 같은 내용의 이미지가 이미 처리됐으면 결과를 새 request_id 경로로 복사 (S3 서버 측 복사)
+    previous_key = f"path/to/{record['request_id']}/swapped_image.png"
+    if not s3_io.object_exists(bucket, previous_key):
+        return None
+    swapped_image_key = f"path/to/{request_id}/swapped_image.png"
+    copy_object(bucket, previous_key, swapped_image_key)
+    copy_web_derivatives(bucket, previous_key, swapped_image_key)
+    pipeline.delete_objects(bucket, [key])
+    print(f"Reused result of request_id {record['request_id']} for {key}: {swapped_image_key}")
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f"Reused previous result for identical image: {swapped_image_key}")
+    }
+
+def reuse_if_finished(bucket, key, request_id, content_key, record):
+    # 결과가 이미 있으면 재사용하고, 처음 요청의 기록이 진행 중으로 남아 있으면 완료로 바꿈
+    reused = reuse_result(bucket, key, request_id, record)
+    if reused is not None and record['status'] != 'done':
+        idempotency.complete(content_key)
+    return reused
 
 def lambda_handler(event, context):
     try:
-        microseconds = int(datetime.now().strftime("%f"))
-        milliseconds = microseconds // 1000
-        current_time_ms_str = datetime.now().strftime("%Y%m%d%H%M%S") + "{:03d}".format(milliseconds)
-        request_id = f"{current_time_ms_str}-{uuid.uuid4()}"
+        request_id = make_request_id()
+        # 이후 단계의 로그/지표를 이 request_id로 묶음
+        telemetry.set_request_id(request_id)
         
         # S3 이벤트에서 버킷 이름과 파일 키 가져오기
         bucket = event['Records'][0]['s3']['bucket']['name']
@@ -27,35 +93,78 @@ def lambda_handler(event, context):
                 'body': json.dumps(f"File {key} is not an image. Skipping Rekognition.")
             }
         
-        # Rekognition을 사용하여 얼굴 바운딩 박스 추출
-        rekognition_response = rekognition_client.detect_faces(
-            Image={
-                'S3Object': {
-                    'Bucket': bucket,
-                    'Name': key
-                }
-            },
-            Attributes=['ALL']
-        )
+        if not idempotency.is_enabled():
+            return submit_image(bucket, key, request_id)
         
-        # 얼굴 바운딩 박스 정보 추출
-        face_details = rekognition_response['FaceDetails']
+        # 같은 업로드 이벤트가 다시 오면 건너뜀 (bucket/key/ETag 기준)
+        _, _, etag = idempotency.event_object(event)
+        upload_key = idempotency.object_key('upload', bucket, key, etag)
+        if not idempotency.CONTENT_HASH:
+            return idempotency.run_once(upload_key, request_id, lambda: submit_image(bucket, key, request_id))
         
-        if face_details:
-            bounding_box = face_details[0]['BoundingBox']
+        # 내용 해시: 다른 키로 다시 올린 같은 이미지면 이전 결과를 재사용
+        # 기록은 처음 요청이 가지고, 마지막 단계(faceSwap 또는 실패 처리)가 완료/실패로 바꿈
+        content_key = idempotency.content_key(s3_io.read_bytes(bucket, key))
+        
+        def submit_unless_duplicate():
+            # 완료로 바뀌기 전에 결과가 먼저 보일 수 있으므로, 기록을 다시 가져가기 전에 결과부터 확인
+            existing = idempotency.get(content_key)
+            if existing is not None and existing['status'] != 'failed':
+                reused = reuse_if_finished(bucket, key, request_id, content_key, existing)
+                if reused is not None:
+                    return reused
+            record = idempotency.begin(content_key, request_id, timeout=idempotency.CONTENT_TIMEOUT_SECONDS)
+            if record is None:
+                response = submit_image(bucket, key, request_id, content_key)
+                if response['statusCode'] != 200:
+                    idempotency.fail(content_key)
+                return response
+            reused = reuse_if_finished(bucket, key, request_id, content_key, record)
+            if reused is not None:
+                return reused
+            # 처음 요청이 아직 진행 중이면 건너뛰지 않고 이 업로드도 따로 처리
+            # (건너뛰면 이 request_id로는 결과가 없고 업로드 파일도 지워지지 않음)
+            print(f"Identical image is still being processed by request_id {record['request_id']}, processing {key} separately")
+            return submit_image(bucket, key, request_id)
+        return idempotency.run_once(upload_key, request_id, submit_unless_duplicate)
+    except Exception as e:
+        print(f"Error processing {key} from bucket {bucket}. Error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Error processing image: {str(e)}")
+        }
+
+def submit_image(bucket, key, request_id, content_key=None):
+    try:
+        # 얼굴 바운딩 박스 추출 (FACE_DETECTOR 환경 변수로 Rekognition / 로컬 CPU 검출기 선택)
+        with telemetry.span('detect_faces', detector=face_detect.FACE_DETECTOR) as fields:
+            face_boxes = face_detect.detect_faces(bucket=bucket, key=key)
+            fields['faces'] = len(face_boxes)
+        
+        if face_boxes:
+            bounding_boxes = [
+                {
+                    'Left': bounding_box['Left'],
+                    'Top': bounding_box['Top'],
+                    'Width': bounding_box['Width'],
+                    'Height': bounding_box['Height']
+                }
+                for bounding_box in face_boxes[:MAX_FACES]
+            ]
             
             # SageMaker 엔드포인트 호출
+            # 모든 얼굴을 한 요청으로 보내서 SAM 인코더는 한 번만 실행 (bounding_box는 첫 번째 얼굴, 기존 호환용)
             test_input = {
                 'request_id': request_id,
                 'bucket': bucket,
                 'key': key,
-                'bounding_box': {
-                    'Left': bounding_box['Left'],
-                    'Top': bounding_box['Top'],
-                    'Width': bounding_box['Width'],
-                    'Height': bounding_box['Height']
-                }
+                'pipeline_mode': pipeline.PIPELINE_MODE,
+                'bounding_box': bounding_boxes[0],
+                'bounding_boxes': bounding_boxes
             }
+            if content_key:
+                # 마지막 단계가 내용 해시 기록을 완료/실패로 바꿀 수 있도록 SAM 출력 메타데이터로 함께 전달
+                test_input['content_key'] = content_key
             
             # 입력 데이터를 S3에 JSON 형식으로 저장 (비동기 추론을 위해 필요)
             input_key = f'input/{request_id}.json'
@@ -67,22 +176,38 @@ def lambda_handler(event, context):
             )
             
             # 비동기 추론 호출
-            response = sagemaker_runtime_client.invoke_endpoint_async(
-                EndpointName='tg-bd-edp',
-                InputLocation=input_location,
-                ContentType='application/json',  # 올바른 Content-Type 설정
-                InvocationTimeoutSeconds=3600  # 최대 1시간 설정 가능
-            )
+            with telemetry.span('submit_sam'):
+                response = sagemaker_runtime_client.invoke_endpoint_async(
+                    EndpointName='tg-bd-edp',
+                    InputLocation=input_location,
+                    ContentType='application/json',  # 올바른 Content-Type 설정
+                    Accept='application/x-sam-mask',  # 압축 마스크 포맷으로 결과 요청
+                    InvocationTimeoutSeconds=3600  # 최대 1시간 설정 가능
+                )
             
             output_location = response['OutputLocation']
             print("Inference request submitted. Output will be stored in:", output_location)
             
+            # 병렬 모드: imgMake는 원본 이미지만 필요하므로 SAM 추론과 동시에 시작
+            if pipeline.PIPELINE_MODE == 'parallel':
+                pipeline.invoke_async('imgMake', {
+                    'bucket': bucket,
+                    'image_key': key,
+                    'request_id': request_id,
+                    'bounding_box': test_input['bounding_box'],
+                    'face_count': len(bounding_boxes),
+                    'content_key': content_key,
+                    'join': True
+                })
+            
             return {
                 'statusCode': 200,
                 'body': json.dumps('Inference request submitted. Check S3 for results.')
             }
         else:
             print(f"No faces detected in the image for {key}")
+            # 결과가 없으므로 같은 사진을 다시 올리면 다시 검출하도록 기록을 실패로
+            idempotency.resolve_content(content_key, False)
             return {
                 'statusCode': 200,
                 'body': json.dumps(f"No faces detected in the image for {key}")
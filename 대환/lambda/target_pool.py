@@ -0,0 +1,201 @@
+import os
+import re
+import time
+import uuid
+import boto3
+from botocore.exceptions import ClientError
+import pipeline
+import s3_io
+import telemetry
+
+# 미리 생성해 둔 타겟(Titan) 이미지 풀
+# 풀 키: {직업}/{얼굴 수}p-{성별}-{피부색}-{머리 길이}-{머리색} (Claude가 준 특징을 몇 개의 구간으로 정규화)
+# 저장 위치: s3://{버킷}/pool/{풀 키}/{uuid}.png, 꺼낼 때는 DynamoDB 조건부 쓰기로 한 요청만 가져가도록 보장
+ENABLED = os.environ.get('TARGET_POOL', '0') == '1'
+POOL_BUCKET = os.environ.get('TARGET_POOL_BUCKET', '')  # 비어 있으면 요청 버킷 사용
+POOL_PREFIX = os.environ.get('TARGET_POOL_PREFIX', 'pool/')
+CAPACITY = int(os.environ.get('TARGET_POOL_CAPACITY', '4'))  # 풀 키당 보관 개수
+MAX_AGE_SECONDS = int(os.environ.get('TARGET_POOL_MAX_AGE_SECONDS', str(7 * 24 * 3600)))  # 오래된 이미지는 제거
+MISS_FILL = int(os.environ.get('TARGET_POOL_MISS_FILL', '1'))  # 처음 나온(드문) 키는 이만큼만 채우고, 꺼내 쓰일 때마다 CAPACITY까지 보충
+CLAIM_TABLE = os.environ.get('TARGET_POOL_CLAIM_TABLE', 'TargetPoolClaimTable')  # 파티션 키: ItemKey (TTL: ExpiresAt)
+REPLENISH_FUNCTION = os.environ.get('TARGET_POOL_FUNCTION', 'replenishPool')
+LEASE_SECONDS = int(os.environ.get('TARGET_POOL_LEASE_SECONDS', '900'))  # 보충 Lambda 최대 실행 시간
+
+dynamodb_client = boto3.client('dynamodb')
+
+# 특징 문자열 -> 구간 (앞에 있는 항목이 먼저 매칭, 없으면 마지막 값)
+GENDERS = [('female', ('female', 'woman', 'girl')), ('male', ('male', 'man', 'boy'))]
+SKIN_TONES = [('dark', ('dark', 'deep', 'ebony')), ('light', ('light', 'fair', 'pale')), ('medium', ())]
+HAIR_LENGTHS = [('bald', ('bald', 'shaved')), ('long', ('long',)), ('short', ('short', 'buzz', 'crew', 'pixie', 'cropped')), ('medium', ())]
+HAIR_COLORS = [
+    ('blonde', ('blond', 'golden')),
+    ('red', ('red', 'auburn', 'ginger')),
+    ('gray', ('gray', 'grey', 'white', 'silver')),
+    ('brown', ('brown', 'brunette', 'chestnut')),
+    ('black', ('black', 'dark')),
+    ('other', ())
+]
+
+def match_bucket(text, buckets):
+    words = set(re.findall(r'[a-z]+', (text or '').lower()))
+    for name, keywords in buckets:
+        if words & set(keywords):
+            return name
+    return buckets[-1][0]
+
+def normalize_attributes(attributes):
+    hairstyle = attributes.get('Hairstyle', '')
+    return {
+        'gender': match_bucket(attributes.get('Gender'), GENDERS + [('person', ())]),
+        'skin': match_bucket(attributes.get('Skin tone'), SKIN_TONES),
+        'length': match_bucket(hairstyle, HAIR_LENGTHS),
+        'color': match_bucket(hairstyle, HAIR_COLORS)
+    }
+
+def pool_key(profession, normalized, face_count=1):
+    profession = re.sub(r'[^a-z0-9]+', '-', profession.lower()).strip('-')
+    return f"{profession}/{face_count}p-{normalized['gender']}-{normalized['skin']}-{normalized['length']}-{normalized['color']}"
+
+def parse_key(key):
+    # pool_key의 역변환 (보충할 때 프롬프트를 다시 만들기 위해 사용)
+    profession, rest = key.split('/', 1)
+    count, gender, skin, length, color = rest.split('-')
+    normalized = {'gender': gender, 'skin': skin, 'length': length, 'color': color}
+    return profession.replace('-', ' '), normalized, int(count[:-1])
+
+def describe(normalized):
+    # 구간 값으로 Titan 프롬프트용 특징 문장 생성
+    if normalized['length'] == 'bald':
+        hair = 'bald head'
+    else:
+        color = '' if normalized['color'] == 'other' else f"{normalized['color']} "
+        hair = f"{normalized['length']} {color}hair"
+    return f"Hairstyle: {hair}, Gender: {normalized['gender']}, Skin tone: {normalized['skin']}"
+
+def pool_bucket(bucket):
+    return POOL_BUCKET or bucket
+
+def list_items(bucket, key):
+    # 오래된 것부터 (먼저 만든 이미지를 먼저 사용)
+    paginator = s3_io.s3_client.get_paginator('list_objects_v2')
+    items = []
+    for page in paginator.paginate(Bucket=pool_bucket(bucket), Prefix=f'{POOL_PREFIX}{key}/'):
+        items.extend(page.get('Contents', []))
+    return sorted(items, key=lambda item: item['LastModified'])
+
+def put_claim(item_key, expires_at):
+    # 처음에는 항목이 없을 때만, 다시 가져갈 때는 만료된 경우에만 성공하는 조건부 쓰기
+    item = {'ItemKey': {'S': item_key}, 'ExpiresAt': {'N': str(expires_at)}}
+    try:
+        dynamodb_client.put_item(TableName=CLAIM_TABLE, Item=item, ConditionExpression='attribute_not_exists(ItemKey)')
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    try:
+        dynamodb_client.put_item(
+            TableName=CLAIM_TABLE,
+            Item=item,
+            ConditionExpression='ExpiresAt < :now',
+            ExpressionAttributeValues={':now': {'N': str(int(time.time()))}}
+        )
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def release_claim(item_key):
+    dynamodb_client.delete_item(TableName=CLAIM_TABLE, Key={'ItemKey': {'S': item_key}})
+
+def claim_item(item_key):
+    # 같은 이미지를 두 요청이 동시에 가져가지 않도록 한 번만 성공
+    try:
+        dynamodb_client.put_item(
+            TableName=CLAIM_TABLE,
+            Item={
+                'ItemKey': {'S': item_key},
+                'ExpiresAt': {'N': str(int(time.time()) + 24 * 3600)}
+            },
+            ConditionExpression='attribute_not_exists(ItemKey)'
+        )
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def lease_key(key):
+    return f'replenish/{key}'
+
+def acquire_lease(key):
+    # 풀 키마다 보충은 한 번에 하나만 실행 (동시에 여러 개가 돌면 같은 부족분을 각자 채워서 초과 생성)
+    return put_claim(lease_key(key), int(time.time()) + LEASE_SECONDS)
+
+def release_lease(key):
+    release_claim(lease_key(key))
+
+def take(bucket, key, destination_key):
+    # 풀에서 이미지 하나를 destination_key로 옮김 (S3 서버 측 복사). 없으면 False
+    source_bucket = pool_bucket(bucket)
+    for item in list_items(bucket, key):
+        if time.time() - item['LastModified'].timestamp() > MAX_AGE_SECONDS:
+            continue
+        if not claim_item(item['Key']):
+            continue
+        try:
+            s3_io.s3_client.copy_object(
+                Bucket=bucket,
+                Key=destination_key,
+                CopySource={'Bucket': source_bucket, 'Key': item['Key']},
+                ContentType='image/png',
+                MetadataDirective='REPLACE'
+            )
+        except Exception:
+            # 복사에 실패하면 다른 요청이 쓸 수 있도록 점유를 풀어줌
+            release_claim(item['Key'])
+            raise
+        s3_io.s3_client.delete_object(Bucket=source_bucket, Key=item['Key'])
+        telemetry.metric('TargetPoolHit', 1, pool_key=key)
+        print(f"Took target image from pool: {item['Key']}")
+        return True
+    telemetry.metric('TargetPoolMiss', 1, pool_key=key)
+    print(f"Target pool miss: {key}")
+    return False
+
+def request_replenish(bucket, key, taken):
+    # 꺼냈으면 CAPACITY까지, 없었으면 MISS_FILL개만 백그라운드에서 채움 (이미 보충 중이면 그쪽이 함께 채움)
+    if not acquire_lease(key):
+        print(f"Pool {key} is already being replenished")
+        return False
+    pipeline.invoke_async(REPLENISH_FUNCTION, {'bucket': bucket, 'pool_key': key, 'target': CAPACITY if taken else MISS_FILL})
+    return True
+
+def list_keys(bucket):
+    # 풀에 있는 모든 풀 키 (정기 보충용)
+    keys = set()
+    paginator = s3_io.s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=pool_bucket(bucket), Prefix=POOL_PREFIX):
+        for item in page.get('Contents', []):
+            keys.add(item['Key'][len(POOL_PREFIX):].rsplit('/', 1)[0])
+    return sorted(keys)
+
+def fresh_items(bucket, key):
+    return [item for item in list_items(bucket, key) if time.time() - item['LastModified'].timestamp() <= MAX_AGE_SECONDS]
+
+def replenish(bucket, key, generate, target=CAPACITY):
+    # 오래된 이미지와 용량 초과분(오래된 것부터)을 지우고, target개가 될 때까지 generate()로 생성해서 채움
+    # 보충 중에 꺼내 간 이미지도 채우도록 하나 만들 때마다 다시 확인 (호출하는 쪽이 acquire_lease로 점유한 상태)
+    source_bucket = pool_bucket(bucket)
+    items = list_items(bucket, key)
+    fresh = [item for item in items if time.time() - item['LastModified'].timestamp() <= MAX_AGE_SECONDS]
+    evicted = [item for item in items if item not in fresh] + fresh[:max(0, len(fresh) - CAPACITY)]
+    pipeline.delete_objects(source_bucket, [item['Key'] for item in evicted])
+
+    target = min(target, CAPACITY)
+    generated = 0
+    while generated < CAPACITY and len(fresh_items(bucket, key)) < target:
+        s3_io.upload_bytes(generate(), source_bucket, f'{POOL_PREFIX}{key}/{uuid.uuid4()}.png', content_type='image/png')
+        generated += 1
+    print(f"Replenished pool {key}: evicted {len(evicted)}, generated {generated}")
+    return generated
@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# 단계별 시간 측정(span)과 지표(metric)를 request_id가 붙은 JSON 한 줄로 출력
+# CloudWatch Embedded Metric Format(EMF)을 따르므로 로그에서 바로 지표로 집계됨
+# 원본은 lambda/telemetry.py, 도커/telemetry.py는 SAM 컨테이너 빌드 컨텍스트용 복사본 (도커/sync_shared.py로 복사/확인)
+NAMESPACE = os.environ.get('TELEMETRY_NAMESPACE', 'BedrockGallery')
+SERVICE = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', os.environ.get('TELEMETRY_SERVICE', 'sam-container'))
+ENABLED = os.environ.get('TELEMETRY_ENABLED', '1') == '1'
+
+# Lambda는 프로세스당 요청 하나를 처리하므로 현재 request_id를 모듈 전역으로 보관
+# warm 컨테이너에서 이전 요청의 id가 남지 않도록 각 lambda_handler 시작에서 다시 설정 (모르면 None)
+current = {'request_id': None}
+
+def set_request_id(request_id):
+    current['request_id'] = request_id
+
+def emit(record, metrics):
+    if not ENABLED:
+        return
+    record.update({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['Service', 'Name']],
+                'Metrics': metrics
+            }]
+        },
+        'Service': SERVICE
+    })
+    sys.stdout.write(json.dumps(record, default=str) + '\n')
+    sys.stdout.flush()
+
+def metric(name, value, unit='Count', request_id=None, **fields):
+    # 카운터/크기 지표 (예: S3 전송 바이트, 캐시 적중)
+    record = {
+        'type': 'metric',
+        'Name': name,
+        'request_id': request_id or current['request_id'],
+        name: value
+    }
+    record.update(fields)
+    emit(record, [{'Name': name, 'Unit': unit}])
+
+@contextmanager
+def span(name, request_id=None, **fields):
+    # with 블록의 실행 시간을 측정해서 출력 (예외가 나도 error와 함께 기록)
+    start = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield fields
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        record = {
+            'type': 'span',
+            'Name': name,
+            'request_id': request_id or current['request_id'],
+            'start': start,
+            'Duration': (time.perf_counter() - started) * 1000
+        }
+        record.update(fields)
+        if error is not None:
+            record['error'] = error
+        emit(record, [{'Name': 'Duration', 'Unit': 'Milliseconds'}])
@@ -0,0 +1,116 @@
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import s3_io
+import telemetry
+
+# 갤러리용 웹 이미지 (원본 PNG 대신 작은 WebP/JPEG를 내려보내서 모바일 로딩 시간과 전송량을 줄임)
+# 원본을 한 번만 디코딩해서 큰 크기부터 차례로 줄이고, 크기 x 포맷별 인코딩/업로드는 동시에 실행
+# 저장 위치: {원본 키에서 확장자를 뺀 경로}.{변형 이름}.{확장자}, 목록은 {...}.web.json (갤러리의 srcset용)
+ENABLED = os.environ.get('WEB_DERIVATIVES', '1') == '1'  # 최종 결과(swapped_image.png)
+INTERMEDIATE = os.environ.get('WEB_DERIVATIVES_INTERMEDIATE', '0') == '1'  # 중간 결과(source_image.png, target.png)
+VARIANTS = os.environ.get('WEB_DERIVATIVE_VARIANTS', 'thumbnail:320,preview:1024,full:0')  # 이름:긴 변 최대 픽셀 (0이면 원본 크기)
+FORMATS = os.environ.get('WEB_DERIVATIVE_FORMATS', 'webp,jpeg')
+QUALITY = {
+    'webp': int(os.environ.get('WEB_WEBP_QUALITY', '80')),
+    'jpeg': int(os.environ.get('WEB_JPEG_QUALITY', '82'))
+}
+WEBP_METHOD = int(os.environ.get('WEB_WEBP_METHOD', '4'))  # 0(빠름) ~ 6(작음)
+# 결과 경로는 request_id마다 달라서 내용이 바뀌지 않으므로 오래 캐시
+CACHE_CONTROL = os.environ.get('WEB_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+UPLOAD_CONCURRENCY = int(os.environ.get('WEB_UPLOAD_CONCURRENCY', '8'))
+
+FORMAT_INFO = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg')
+}
+
+def parse_variants(text=VARIANTS):
+    variants = []
+    for item in text.split(','):
+        name, max_edge = item.split(':')
+        variants.append((name.strip(), int(max_edge)))
+    # 원본 크기(0)가 가장 크고, 그다음은 큰 크기부터 (작은 변형을 바로 앞 변형에서 줄이기 위해)
+    return sorted(variants, key=lambda variant: -variant[1] if variant[1] else float('-inf'))
+
+def variant_key(key, name, extension):
+    return f"{key.rsplit('.', 1)[0]}.{name}.{extension}"
+
+def manifest_key(key):
+    return f"{key.rsplit('.', 1)[0]}.web.json"
+
+def render_variants(image, variants):
+    # 원본보다 큰 크기로는 늘리지 않고, 각 변형은 직전(더 큰) 변형에서 줄여서 리샘플링 비용을 줄임
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    rendered = []
+    current = image
+    for name, max_edge in variants:
+        if max_edge and max(current.size) > max_edge:
+            scale = max_edge / max(current.size)
+            size = (max(1, round(current.width * scale)), max(1, round(current.height * scale)))
+            current = current.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        rendered.append((name, current))
+    return rendered
+
+def encode_variant(image, format_name):
+    pil_format, _, _ = FORMAT_INFO[format_name]
+    if format_name == 'jpeg':
+        if image.mode == 'RGBA':
+            # JPEG는 투명도가 없으므로 흰 배경에 합성 (잘라낸 소스 이미지)
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        return s3_io.encode_image(image, pil_format, quality=QUALITY['jpeg'], optimize=True, progressive=True)
+    return s3_io.encode_image(image, pil_format, quality=QUALITY['webp'], method=WEBP_METHOD)
+
+def upload_variant(image, format_name, bucket, key):
+    data = encode_variant(image, format_name)
+    s3_io.upload_bytes(data, bucket, key, content_type=FORMAT_INFO[format_name][2], cache_control=CACHE_CONTROL)
+    return len(data)
+
+def publish(data, bucket, key, content_type='image/png', metadata=None, image=None, derive=ENABLED):
+    # 원본 업로드와 웹 변형 업로드를 한 스레드 풀에서 동시에 실행하고 변형 목록(manifest)을 반환
+    # image: 이미 디코딩된 PIL 이미지가 있으면 다시 디코딩하지 않음
+    if not derive:
+        s3_io.upload_bytes(data, bucket, key, content_type=content_type, metadata=metadata)
+        return None
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+        original_future = executor.submit(s3_io.upload_bytes, data, bucket, key, content_type=content_type, metadata=metadata)
+
+        with telemetry.span('web_decode_resize'):
+            if image is None:
+                image = Image.open(io.BytesIO(data))
+            # 지연 로딩된 이미지를 여러 인코딩 스레드가 동시에 읽지 않도록 여기서 디코딩
+            image.load()
+            rendered = render_variants(image, parse_variants())
+
+        manifest = {'original': key, 'variants': {}}
+        futures = []
+        previous_image, previous_entry = None, None
+        for name, variant_image in rendered:
+            if variant_image is previous_image:
+                # 원본이 작아서 줄일 필요가 없으면 같은 파일을 다시 올리지 않고 앞 변형의 키를 그대로 사용
+                manifest['variants'][name] = previous_entry
+                continue
+            entry = {'width': variant_image.width, 'height': variant_image.height}
+            for format_name in FORMATS.split(','):
+                variant_image_key = variant_key(key, name, FORMAT_INFO[format_name][1])
+                entry[format_name] = variant_image_key
+                futures.append((variant_image_key, executor.submit(upload_variant, variant_image, format_name, bucket, variant_image_key)))
+            manifest['variants'][name] = entry
+            previous_image, previous_entry = variant_image, entry
+
+        original_future.result()
+        sizes = {variant_image_key: future.result() for variant_image_key, future in futures}
+
+    s3_io.upload_bytes(
+        json.dumps(manifest).encode('utf-8'), bucket, manifest_key(key),
+        content_type='application/json', cache_control=CACHE_CONTROL
+    )
+    telemetry.metric('WebDerivativeBytes', sum(sizes.values()), unit='Bytes', key=key, original_bytes=len(data))
+    print(f"Uploaded web derivatives of {key} ({len(data)} bytes): {sizes}")
+    return manifest
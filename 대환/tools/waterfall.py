@@ -0,0 +1,88 @@
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+# telemetry.py가 출력한 span 로그로 요청별 단계 타임라인(waterfall)을 재구성
+# 입력: CloudWatch Logs에서 내려받은 로그 파일 (여러 Lambda/컨테이너 로그를 함께 넘겨도 됨), 없으면 stdin
+BAR_WIDTH = 50
+
+def parse_records(lines):
+    for line in lines:
+        # CloudWatch 로그는 앞에 타임스탬프 등이 붙을 수 있으므로 첫 '{'부터 JSON으로 해석
+        start = line.find('{')
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get('type') in ('span', 'metric'):
+            yield record
+
+def record_request_ids(record):
+    # 컨테이너의 배치 span은 request_ids 목록을 가짐
+    request_ids = set(record.get('request_ids') or [])
+    if record.get('request_id'):
+        request_ids.add(record['request_id'])
+    return request_ids
+
+def group_by_request(records):
+    requests = defaultdict(lambda: {'spans': [], 'metrics': []})
+    for record in records:
+        kind = 'spans' if record['type'] == 'span' else 'metrics'
+        for request_id in record_request_ids(record):
+            requests[request_id][kind].append(record)
+    return requests
+
+def print_waterfall(request_id, spans, metrics):
+    spans = sorted(spans, key=lambda span: span['start'])
+    begin = spans[0]['start']
+    end = max(span['start'] + span['Duration'] / 1000 for span in spans)
+    total_ms = max((end - begin) * 1000, 1e-6)
+
+    print(f"\nrequest_id: {request_id}  total: {total_ms:.1f} ms")
+    print(f"{'service':<16} {'stage':<18} {'offset ms':>10} {'ms':>9}  timeline")
+    for span in spans:
+        offset_ms = (span['start'] - begin) * 1000
+        bar_start = int(offset_ms / total_ms * BAR_WIDTH)
+        bar_length = max(1, int(round(span['Duration'] / total_ms * BAR_WIDTH)))
+        bar = ' ' * bar_start + ('!' if span.get('error') else '#') * bar_length
+        print(f"{span.get('Service', '-'):<16} {span['Name']:<18} {offset_ms:>10.1f} {span['Duration']:>9.1f}  |{bar:<{BAR_WIDTH}}|")
+
+    totals = defaultdict(float)
+    for metric in metrics:
+        totals[metric['Name']] += metric[metric['Name']]
+    for name, value in sorted(totals.items()):
+        print(f"  {name}: {value:g}")
+
+def main():
+    parser = argparse.ArgumentParser(description='request_id별 단계 타임라인 출력')
+    parser.add_argument('logs', nargs='*', help='로그 파일 (없으면 stdin)')
+    parser.add_argument('--request-id', help='이 요청만 출력 (없으면 전체)')
+    args = parser.parse_args()
+
+    lines = []
+    if args.logs:
+        for path in args.logs:
+            with open(path, encoding='utf-8') as f:
+                lines.extend(f)
+    else:
+        lines = sys.stdin
+
+    requests = group_by_request(parse_records(lines))
+    if args.request_id:
+        requests = {args.request_id: requests[args.request_id]} if args.request_id in requests else {}
+    if not requests:
+        sys.exit("No spans found")
+
+    # 첫 span 시작 시각 순서로 출력
+    ordered = sorted(
+        (item for item in requests.items() if item[1]['spans']),
+        key=lambda item: min(span['start'] for span in item[1]['spans'])
+    )
+    for request_id, request in ordered:
+        print_waterfall(request_id, request['spans'], request['metrics'])
+
+if __name__ == '__main__':
+    main()
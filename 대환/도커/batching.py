@@ -0,0 +1,48 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# 동시에 들어온 요청을 모아 배치 함수 한 번으로 처리하는 마이크로 배처 (serve.py, batch/gallery_batch.py에서 공용)
+# 최대 배치 크기 또는 최대 대기 시간 중 먼저 도달하는 쪽에서 배치 실행
+class MicroBatcher:
+    # process_batch: 입력 목록 -> 같은 순서의 결과 목록 (항목별 실패는 Exception 객체로 반환)
+    def __init__(self, process_batch, max_batch_size, max_wait_ms):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, input_data):
+        future = Future()
+        self.requests.put((input_data, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.process(batch)
+
+    def process(self, batch):
+        try:
+            results = self.process_batch([input_data for input_data, _ in batch])
+        except Exception as e:
+            print(f"Error processing batch: {e}")
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,26 @@
+import argparse
+import os
+import time
+from inference import SAM_CHECKPOINTS, SAM_MODEL_TYPE, SAM_WEIGHTS_DTYPE, ENCODER_STORAGE_DTYPES, converted_path, convert_checkpoint, load_converted
+
+# 이미지 빌드 시 SAM 체크포인트를 미리 safetensors로 변환 (컨테이너 시작 때 변환 시간이 들지 않도록)
+def main():
+    parser = argparse.ArgumentParser(description='SAM 체크포인트(.pth)를 mmap 가능한 safetensors로 변환')
+    parser.add_argument('model_dir', help='SAM 체크포인트(.pth)가 있는 폴더')
+    parser.add_argument('--model-type', default=SAM_MODEL_TYPE, choices=sorted(SAM_CHECKPOINTS))
+    parser.add_argument('--dtype', default=SAM_WEIGHTS_DTYPE, choices=sorted(ENCODER_STORAGE_DTYPES))
+    parser.add_argument('--output-dir', help='변환 파일 저장 폴더 (기본: model_dir)')
+    args = parser.parse_args()
+
+    output_path = converted_path(args.output_dir or args.model_dir, args.dtype, args.model_type)
+    started = time.perf_counter()
+    convert_checkpoint(os.path.join(args.model_dir, SAM_CHECKPOINTS[args.model_type]), output_path, args.dtype, args.model_type)
+    print(f"Converted in {time.perf_counter() - started:.2f}s")
+
+    # 변환 결과를 실제 시작 경로로 한 번 읽어서 확인
+    started = time.perf_counter()
+    load_converted(output_path, args.dtype, args.model_type)
+    print(f"Loaded {output_path} in {time.perf_counter() - started:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import inspect
+import os
+import tempfile
+import time
+import warnings
+import torch
+from segment_anything.utils.onnx import SamOnnxModel
+
+# SAM 인코더와 마스크 디코더를 onnxruntime용 ONNX로 내보냄 (SAM_ENGINE=onnx)
+# 인코더: images (B, 3, 1024, 1024, 정규화 + 패딩된 입력) -> image_embeddings (B, 256, 64, 64)
+# 디코더: segment_anything의 SamOnnxModel 기반 (박스는 라벨 2, 3인 두 점으로 입력, 256x256 마스크 로짓 출력)
+ONNX_OPSET = 17
+
+class ImageEncoderOnnx(torch.nn.Module):
+    def __init__(self, sam_model):
+        super().__init__()
+        self.image_encoder = sam_model.image_encoder
+
+    def forward(self, images):
+        return self.image_encoder(images)
+
+def onnx_export(module, args, path, input_names, output_names, dynamic_axes):
+    # torch 2.5 이후 기본값인 dynamo 경로 대신 dynamic_axes를 지원하는 TorchScript 경로 사용
+    kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.filterwarnings('ignore', category=torch.jit.TracerWarning)
+        warnings.filterwarnings('ignore', category=UserWarning)
+        warnings.filterwarnings('ignore', category=DeprecationWarning)
+        torch.onnx.export(
+            module, args, path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True,
+            **kwargs
+        )
+
+def export_encoder(sam_model, path):
+    image_size = sam_model.image_encoder.img_size
+    onnx_export(
+        ImageEncoderOnnx(sam_model),
+        (torch.randn(1, 3, image_size, image_size),),
+        path,
+        input_names=['images'],
+        output_names=['image_embeddings'],
+        dynamic_axes={'images': {0: 'batch'}, 'image_embeddings': {0: 'batch'}}
+    )
+
+class MaskDecoderOnnx(SamOnnxModel):
+    # 원본 크기 복원(mask_postprocessing)은 추적할 때 예시 입력의 이미지 크기가 상수로 굳어 다른 크기에서 틀리므로
+    # 256x256 저해상도 로짓까지만 내보내고 복원은 inference.OnnxSam에서 Sam.postprocess_masks와 같은 방식으로 처리
+    def forward(self, image_embeddings, point_coords, point_labels, mask_input, has_mask_input):
+        sparse_embedding = self._embed_points(point_coords, point_labels)
+        dense_embedding = self._embed_masks(mask_input, has_mask_input)
+        masks, scores = self.model.mask_decoder.predict_masks(
+            image_embeddings=image_embeddings,
+            image_pe=self.model.prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embedding,
+            dense_prompt_embeddings=dense_embedding
+        )
+        return masks, scores
+
+def export_decoder(sam_model, path):
+    # 마스크 4장(단일 마스크 토큰 + multimask 3장)을 모두 내보내서 호출하는 쪽에서 torch 경로와 같은 마스크를 선택
+    # 박스 여러 개(단체 사진)는 첫 번째 축으로 묶어서 한 번에 디코딩
+    decoder = MaskDecoderOnnx(sam_model, return_single_mask=False)
+    embed_dim = sam_model.prompt_encoder.embed_dim
+    embed_size = sam_model.prompt_encoder.image_embedding_size
+    mask_input_size = [4 * size for size in embed_size]
+    onnx_export(
+        decoder,
+        (
+            torch.randn(1, embed_dim, *embed_size),
+            torch.randint(0, 1024, (2, 2, 2), dtype=torch.float),
+            torch.tensor([[2, 3], [2, 3]], dtype=torch.float),
+            torch.zeros(1, 1, *mask_input_size),
+            torch.zeros(1)
+        ),
+        path,
+        input_names=['image_embeddings', 'point_coords', 'point_labels', 'mask_input', 'has_mask_input'],
+        output_names=['low_res_masks', 'iou_predictions'],
+        dynamic_axes={
+            'point_coords': {0: 'boxes', 1: 'num_points'},
+            'point_labels': {0: 'boxes', 1: 'num_points'},
+            'low_res_masks': {0: 'boxes'},
+            'iou_predictions': {0: 'boxes'}
+        }
+    )
+
+def export_onnx(sam_model, paths, weights_dtype='float32'):
+    # paths: (인코더 경로, 디코더 경로), int8이면 float32 인코더를 내보낸 뒤 동적 양자화
+    # ViT-H 인코더는 2GB를 넘으므로 가중치가 .onnx 옆의 외부 데이터 파일로 저장됨
+    encoder_path, decoder_path = paths
+    sam_model = sam_model.float().eval()
+    started = time.perf_counter()
+    if weights_dtype == 'int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(encoder_path)) as temp_dir:
+            float_path = os.path.join(temp_dir, 'encoder.float32.onnx')
+            export_encoder(sam_model, float_path)
+            quantize_dynamic(float_path, encoder_path, weight_type=QuantType.QUInt8, use_external_data_format=True)
+    else:
+        export_encoder(sam_model, encoder_path)
+    export_decoder(sam_model, decoder_path)
+    print(f"Exported {encoder_path} and {decoder_path} in {time.perf_counter() - started:.2f}s")
+    return encoder_path, decoder_path
+
+def main():
+    from inference import SAM_CHECKPOINTS, SAM_MODEL_TYPE, find_or_convert, load_converted, onnx_paths
+
+    # 이미지 빌드 시 한 번 실행 (SAM_ENGINE=onnx 컨테이너가 시작할 때 내보내는 시간이 들지 않도록)
+    parser = argparse.ArgumentParser(description='SAM 체크포인트를 onnxruntime용 인코더/디코더 ONNX로 내보내기')
+    parser.add_argument('model_dir', help='SAM 체크포인트(.pth)가 있는 폴더')
+    parser.add_argument('--model-type', default=SAM_MODEL_TYPE, choices=sorted(SAM_CHECKPOINTS))
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'int8'])
+    parser.add_argument('--output-dir', help='ONNX 파일 저장 폴더 (기본: model_dir)')
+    args = parser.parse_args()
+
+    sam_model = load_converted(find_or_convert(args.model_dir, 'float32', args.model_type), 'float32', args.model_type)
+    export_onnx(sam_model, onnx_paths(args.output_dir or args.model_dir, args.dtype, args.model_type), args.dtype)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import gc
+import os
+
+# SAM 컨테이너 운영 서버 설정 (ENTRYPOINT: gunicorn --config gunicorn.conf.py serve:app)
+# 마스터 프로세스에서 모델을 한 번 로딩한 뒤 fork해서 워커끼리 가중치 메모리를 공유 (copy-on-write)
+# safetensors 가중치는 파일 mmap이라 워커 수와 상관없이 페이지 캐시 한 벌만 사용
+workers = int(os.environ.get('SAM_WORKERS', '2'))
+
+# 워커당 스레드 = /invocations 대기 상한(처리 중 + 배치 대기) + /ping 전용 여유 스레드
+# gthread는 스레드가 모두 막혀 있으면 새 연결(/ping 포함)을 줄 세우므로, 대기 상한은 항상 스레드 수보다 작아야
+# 상한을 넘는 /invocations는 serve.py에서 바로 503으로 거절되고 /ping은 배치가 밀려 있어도 응답됨
+worker_class = 'gthread'
+max_batch_size = int(os.environ.get('SAM_MAX_BATCH_SIZE', '4'))
+ping_threads = max(1, int(os.environ.get('SAM_PING_THREADS', '2')))
+max_pending_requests = int(os.environ.get('SAM_MAX_PENDING_REQUESTS', str(max_batch_size * 4)))
+threads = int(os.environ.get('SAM_WORKER_THREADS', str(max_pending_requests + ping_threads)))
+# 스레드 수를 직접 지정한 경우에도 /ping용 스레드가 남도록 대기 상한을 줄여서 serve.py에 전달
+max_pending_requests = max(1, min(max_pending_requests, threads - ping_threads))
+threads = max(threads, max_pending_requests + ping_threads)
+os.environ['SAM_MAX_PENDING_REQUESTS'] = str(max_pending_requests)
+
+bind = f"0.0.0.0:{os.environ.get('SAM_PORT', '8080')}"
+chdir = os.path.dirname(os.path.abspath(__file__))
+timeout = int(os.environ.get('SAM_WORKER_TIMEOUT', '600'))
+graceful_timeout = 30
+keepalive = 75  # SageMaker 앞단 연결 유지 시간보다 길게
+
+# fork 전에 모델을 다 올려야 하므로 import 시 동기 로딩 (백그라운드 로딩 스레드는 fork되지 않음)
+preload_app = True
+os.environ['SAM_MODEL_LOAD_MODE'] = 'sync'
+
+def when_ready(server):
+    # 로딩된 객체를 GC 대상에서 빼서 워커의 GC가 공유 페이지를 건드려 복사되는 것을 막음
+    gc.freeze()
+
+def post_fork(server, worker):
+    import serve
+    serve.configure_torch_threads(workers)
@@ -1,14 +1,381 @@
 import os
+import io
 import json
+import struct
+import zlib
+import hashlib
+import threading
+import time
+import tempfile
+from collections import OrderedDict
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
 import boto3
+import torch
+import torch.nn.functional as F
+from safetensors.torch import load_file, save_file
+import telemetry
 from segment_anything import SamPredictor, sam_model_registry
+from segment_anything.utils.transforms import ResizeLongestSide
+
+s3_client = boto3.client('s3')
+
+# 압축 마스크 출력 포맷 (비트 패킹 + zlib)
+# 구조: MASK_MAGIC | 헤더 길이(4바이트, big-endian) | JSON 헤더 | 마스크 비트
+MASK_CONTENT_TYPE = 'application/x-sam-mask'
+MASK_MAGIC = b'SAMMASK1'
+MASK_COMPRESSION = os.environ.get('SAM_MASK_COMPRESSION', 'zlib')  # 'zlib' 또는 'none'
+
+# 이미지 임베딩 캐시 최대 크기 (ViT-H 임베딩 1개 = 약 4MB), 0이면 캐시 사용 안 함
+EMBEDDING_CACHE_BYTES = int(os.environ.get('SAM_EMBEDDING_CACHE_BYTES', str(512 * 1024 * 1024)))
+
+# SAM 모델 설정
+# 백본: vit_h(기본, 가장 정확) | vit_l | vit_b (CPU에서 인코더가 몇 배 빠르고 얼굴 마스크 품질 차이는 작음)
+# 엔진: torch | onnx (인코더/디코더를 ONNX로 내보내 onnxruntime으로 실행, export_onnx.py)
+SAM_MODEL_TYPE = os.environ.get('SAM_MODEL_TYPE', 'vit_h')
+SAM_ENGINE = os.environ.get('SAM_ENGINE', 'torch')
+SAM_CHECKPOINTS = {
+    'vit_h': 'sam_vit_h_4b8939.pth',
+    'vit_l': 'sam_vit_l_0b3195.pth',
+    'vit_b': 'sam_vit_b_01ec64.pth'
+}
+
+# SAM 가중치 설정
+# 원본 .pth를 한 번 safetensors로 변환해 두고, 이후에는 mmap으로 바로 올려서 시작 시간을 줄임
+SAM_CHECKPOINT = SAM_CHECKPOINTS[SAM_MODEL_TYPE]
+SAM_WEIGHTS_DTYPE = os.environ.get('SAM_WEIGHTS_DTYPE', 'float32')  # float32 | float16 | bfloat16 | int8 (CPU 동적 양자화), onnx는 float32 | int8
+SAM_CONVERTED_DIR = os.environ.get('SAM_CONVERTED_DIR', '')  # 변환 파일 위치 (기본: 모델 폴더, 쓸 수 없으면 /tmp)
+
+# 이미지 인코더만 저정밀도로 저장 (프롬프트 인코더/마스크 디코더는 작아서 float32 유지)
+# int8은 양자화된 모듈을 파일로 저장할 수 없으므로 float32 파일을 읽은 뒤 로딩 시점에 양자화
+ENCODER_STORAGE_DTYPES = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+    'int8': torch.float32
+}
+
+class EmbeddingCache:
+    # 이미지 내용 해시 -> (features, original_size, input_size) LRU 캐시
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.current_bytes += size
+
+            # 메모리 한도를 넘으면 가장 오래 사용하지 않은 임베딩부터 제거
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes
+            }
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_BYTES)
+
+# 프로세스 단위로 재사용하는 SamPredictor (set_image 상태를 가지므로 lock으로 보호)
+sam_predictor = None
+sam_predictor_lock = threading.Lock()
+
+def get_predictor(model):
+    # ONNX 엔진은 전처리와 디코더를 직접 가지고 있어서 모델 자체가 predictor 역할
+    if isinstance(model, OnnxSam):
+        return model
+    global sam_predictor
+    if sam_predictor is None or sam_predictor.model is not model:
+        sam_predictor = SamPredictor(model)
+    return sam_predictor
+
+def encode_images(model, predictor, images):
+    # 여러 이미지를 한 번의 인코더(ViT) 호출로 배치 처리 (SamPredictor.set_image와 동일한 전처리)
+    if isinstance(model, OnnxSam):
+        return model.encode(images)
+    input_batch = []
+    sizes = []
+    for image_np in images:
+        input_image = predictor.transform.apply_image(image_np)
+        input_torch = torch.as_tensor(input_image, device=predictor.device)
+        input_torch = input_torch.permute(2, 0, 1).contiguous()[None, :, :, :]
+        sizes.append((image_np.shape[:2], tuple(input_torch.shape[-2:])))
+        input_batch.append(model.preprocess(input_torch))
+
+    # 인코더가 저정밀도로 로드된 경우 입력을 맞춰서 넣고, 디코더/캐시에는 float32로 돌려줌
+    encoder_dtype = model.image_encoder.patch_embed.proj.weight.dtype
+    with torch.no_grad():
+        features = model.image_encoder(torch.cat(input_batch, dim=0).to(encoder_dtype)).float()
+
+    # 배치 텐서 전체가 캐시에 붙잡히지 않도록 이미지별로 복사
+    return [
+        (features[i:i + 1].clone(), original_size, input_size)
+        for i, (original_size, input_size) in enumerate(sizes)
+    ]
+
+def decode_image(image_bytes):
+    # Rekognition 바운딩 박스는 EXIF 회전이 적용된 좌표이므로 같은 방향으로 맞추고,
+    # 팔레트/흑백/RGBA 이미지도 SAM 입력 형식(HxWx3 RGB)으로 통일
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    return np.array(image.convert('RGB'))
+
+def get_embeddings(model, predictor, image_bytes_list, request_ids=None):
+    # 같은 이미지면 인코더를 건너뛰고 캐시된 임베딩을 그대로 사용
+    image_hashes = [hashlib.sha256(image_bytes).hexdigest() for image_bytes in image_bytes_list]
+    embeddings = {}
+    missing = OrderedDict()
+    for image_hash, image_bytes in zip(image_hashes, image_bytes_list):
+        if image_hash in embeddings or image_hash in missing:
+            continue
+        cached = embedding_cache.get(image_hash)
+        if cached is not None:
+            embeddings[image_hash] = cached
+        else:
+            missing[image_hash] = image_bytes
+
+    # 배치 단위 지표이므로 배치에 포함된 request_id 목록을 함께 기록
+    telemetry.metric('EmbeddingCacheHit', len(embeddings), request_ids=request_ids)
+    telemetry.metric('EmbeddingCacheMiss', len(missing), request_ids=request_ids)
+
+    if missing:
+        with telemetry.span('sam_encode', request_ids=request_ids, images=len(missing)):
+            images = [decode_image(image_bytes) for image_bytes in missing.values()]
+            encoded = encode_images(model, predictor, images)
+        for image_hash, embedding in zip(missing, encoded):
+            features = embedding[0]
+            embedding_cache.put(image_hash, embedding, features.element_size() * features.nelement())
+            embeddings[image_hash] = embedding
+
+    return [embeddings[image_hash] for image_hash in image_hashes]
+
+def box_to_pixels(bounding_box, image_width, image_height):
+    # 바운딩 박스 좌표 변환 (정규화 좌표 -> 픽셀 x1, y1, x2, y2)
+    left = bounding_box['Left'] * image_width
+    top = bounding_box['Top'] * image_height
+    width = bounding_box['Width'] * image_width
+    height = bounding_box['Height'] * image_height
+    return [left, top, left + width, top + height]
+
+def predict_with_embedding(predictor, embedding, bounding_boxes):
+    image_height, image_width = embedding[1]
+
+    # numpy 배열로 변환
+    box_np = np.array([box_to_pixels(box, image_width, image_height) for box in bounding_boxes])
+    if isinstance(predictor, OnnxSam):
+        return {
+            'masks': predictor.predict(embedding, box_np)
+        }
+
+    predictor.features, predictor.original_size, predictor.input_size = embedding
+    predictor.is_image_set = True
+
+    # 예측
+    if len(box_np) == 1:
+        masks, _, _ = predictor.predict(box=box_np)
+    else:
+        # 여러 얼굴은 박스 프롬프트를 한 번에 디코더에 넣고 얼굴마다 마스크 하나씩 (N, H, W)
+        boxes = torch.as_tensor(box_np, dtype=torch.float, device=predictor.device)
+        boxes = predictor.transform.apply_boxes_torch(boxes, predictor.original_size)
+        with torch.no_grad():
+            masks, _, _ = predictor.predict_torch(point_coords=None, point_labels=None, boxes=boxes, multimask_output=False)
+        masks = masks[:, 0].cpu().numpy()
+    return {
+        'masks': masks
+    }
+
+def converted_path(directory, weights_dtype=SAM_WEIGHTS_DTYPE, model_type=SAM_MODEL_TYPE):
+    storage_dtype = str(ENCODER_STORAGE_DTYPES[weights_dtype]).replace('torch.', '')
+    return os.path.join(directory, SAM_CHECKPOINTS[model_type].replace('.pth', f'.{storage_dtype}.safetensors'))
+
+def convert_checkpoint(checkpoint_path, output_path, weights_dtype=SAM_WEIGHTS_DTYPE, model_type=SAM_MODEL_TYPE):
+    # torch.load로 한 번 읽어서 safetensors로 저장 (이미지 빌드 시 또는 첫 시작 시 한 번만 실행)
+    sam_model = sam_model_registry[model_type](checkpoint=checkpoint_path)
+    sam_model.image_encoder.to(ENCODER_STORAGE_DTYPES[weights_dtype])
+    tensors = {name: tensor.contiguous() for name, tensor in sam_model.state_dict().items()}
+
+    # 다른 프로세스가 반쯤 쓴 파일을 읽지 않도록 임시 파일에 쓴 뒤 rename
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix='.tmp')
+    os.close(fd)
+    try:
+        save_file(tensors, temp_path, metadata={'source': os.path.basename(checkpoint_path), 'encoder_dtype': weights_dtype})
+        os.replace(temp_path, output_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    print(f"Converted {checkpoint_path} to {output_path}")
+    return output_path
+
+def load_converted(path, weights_dtype=SAM_WEIGHTS_DTYPE, model_type=SAM_MODEL_TYPE):
+    # meta 디바이스에서 빈 모델을 만들어 랜덤 초기화를 건너뛰고, mmap된 텐서를 그대로 파라미터로 사용
+    tensors = load_file(path)
+    with torch.device('meta'):
+        sam_model = sam_model_registry[model_type]()
+    sam_model.load_state_dict(tensors, assign=True)
+    not_loaded = [name for name, tensor in list(sam_model.named_parameters()) + list(sam_model.named_buffers()) if tensor.is_meta]
+    if not_loaded:
+        raise ValueError(f"Weights missing from {path}: {not_loaded}")
+
+    if weights_dtype == 'int8':
+        # CPU에서 인코더의 Linear 레이어(연산 대부분)를 int8 동적 양자화
+        sam_model.image_encoder = torch.ao.quantization.quantize_dynamic(
+            sam_model.image_encoder, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return sam_model.eval()
+
+def converted_directories(model_dir):
+    return [SAM_CONVERTED_DIR] if SAM_CONVERTED_DIR else [model_dir, tempfile.gettempdir()]
+
+def find_or_convert(model_dir, weights_dtype=SAM_WEIGHTS_DTYPE, model_type=SAM_MODEL_TYPE):
+    directories = converted_directories(model_dir)
+    for directory in directories:
+        if os.path.exists(converted_path(directory, weights_dtype, model_type)):
+            return converted_path(directory, weights_dtype, model_type)
+
+    # 변환 파일이 없으면 쓸 수 있는 첫 위치에 변환 (SageMaker의 /opt/ml/model은 읽기 전용일 수 있음)
+    checkpoint_path = os.path.join(model_dir, SAM_CHECKPOINTS[model_type])
+    for directory in directories:
+        if os.access(directory, os.W_OK):
+            output_path = converted_path(directory, weights_dtype, model_type)
+            return convert_checkpoint(checkpoint_path, output_path, weights_dtype, model_type)
+    raise ValueError(f"No writable directory to convert {checkpoint_path}")
+
+class OnnxSam:
+    # onnxruntime으로 실행하는 SAM (export_onnx.py로 내보낸 인코더 + 마스크 디코더)
+    # 전처리/후처리는 SamPredictor와 같은 ResizeLongestSide + 정규화 + 1024 패딩
+    # onnxruntime 스레드 풀은 fork를 넘어가지 않으므로 세션은 프로세스마다 처음 사용할 때 생성
+    # (스레드 수는 serve.configure_torch_threads가 정한 torch 스레드 수를 따름)
+    def __init__(self, encoder_path, decoder_path, image_size=1024):
+        self.encoder_path = encoder_path
+        self.decoder_path = decoder_path
+        self.image_size = image_size
+        self.transform = ResizeLongestSide(image_size)
+        self.pixel_mean = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+        self.pixel_std = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+        self.sessions = None
+        self.sessions_pid = None
+        self.sessions_lock = threading.Lock()
+
+    def get_sessions(self):
+        with self.sessions_lock:
+            if self.sessions is None or self.sessions_pid != os.getpid():
+                import onnxruntime
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = torch.get_num_threads()
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                self.sessions = tuple(
+                    onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+                    for path in (self.encoder_path, self.decoder_path)
+                )
+                self.sessions_pid = os.getpid()
+            return self.sessions
+
+    def preprocess(self, image_np):
+        input_image = self.transform.apply_image(image_np).astype(np.float32)
+        input_size = input_image.shape[:2]
+        input_image = (input_image - self.pixel_mean) / self.pixel_std
+        padded = np.zeros((self.image_size, self.image_size, 3), dtype=np.float32)
+        padded[:input_size[0], :input_size[1]] = input_image
+        return padded.transpose(2, 0, 1), input_size
+
+    def encode(self, images):
+        encoder, _ = self.get_sessions()
+        input_batch = []
+        sizes = []
+        for image_np in images:
+            input_image, input_size = self.preprocess(image_np)
+            input_batch.append(input_image)
+            sizes.append((image_np.shape[:2], input_size))
+        features = encoder.run(None, {'images': np.stack(input_batch)})[0]
+
+        # torch 엔진과 같은 형식으로 임베딩 캐시에 저장
+        return [
+            (torch.from_numpy(features[i:i + 1].copy()), original_size, input_size)
+            for i, (original_size, input_size) in enumerate(sizes)
+        ]
+
+    def postprocess_masks(self, low_res_masks, input_size, original_size):
+        # Sam.postprocess_masks와 동일: 1024로 키우고 패딩을 잘라낸 뒤 원본 크기로
+        masks = F.interpolate(torch.from_numpy(low_res_masks), (self.image_size, self.image_size), mode='bilinear', align_corners=False)
+        masks = masks[..., :input_size[0], :input_size[1]]
+        return F.interpolate(masks, original_size, mode='bilinear', align_corners=False)
+
+    def predict(self, embedding, box_np):
+        # 박스 하나는 torch 경로처럼 multimask 3장, 여러 개는 한 번의 디코더 호출로 얼굴마다 단일 마스크 (N, H, W)
+        _, decoder = self.get_sessions()
+        features, original_size, input_size = embedding
+        point_coords = self.transform.apply_coords(box_np.reshape(-1, 2, 2), original_size)
+        low_res_masks = decoder.run(['low_res_masks'], {
+            'image_embeddings': features.numpy(),
+            'point_coords': point_coords.astype(np.float32),
+            'point_labels': np.tile(np.array([[2, 3]], dtype=np.float32), (len(box_np), 1)),
+            'mask_input': np.zeros((1, 1, 256, 256), dtype=np.float32),
+            'has_mask_input': np.zeros(1, dtype=np.float32)
+        })[0]
+        low_res_masks = low_res_masks[:, 1:] if len(box_np) == 1 else low_res_masks[:, :1]
+        masks = self.postprocess_masks(low_res_masks, input_size, original_size) > 0.0
+        return masks[0].numpy() if len(box_np) == 1 else masks[:, 0].numpy()
+
+def onnx_paths(directory, weights_dtype=SAM_WEIGHTS_DTYPE, model_type=SAM_MODEL_TYPE):
+    # 디코더는 작아서 항상 float32, 인코더만 int8 동적 양자화 버전을 따로 둠
+    if weights_dtype not in ('float32', 'int8'):
+        raise ValueError(f"ONNX engine supports float32 or int8 weights, not {weights_dtype}")
+    return (
+        os.path.join(directory, f'sam_{model_type}_encoder.{weights_dtype}.onnx'),
+        os.path.join(directory, f'sam_{model_type}_decoder.onnx')
+    )
+
+def find_or_export(model_dir, weights_dtype=SAM_WEIGHTS_DTYPE, model_type=SAM_MODEL_TYPE):
+    directories = converted_directories(model_dir)
+    for directory in directories:
+        paths = onnx_paths(directory, weights_dtype, model_type)
+        if all(os.path.exists(path) for path in paths):
+            return paths
+
+    # 이미지 빌드 시 내보내지 않았으면 쓸 수 있는 첫 위치에 내보냄 (float32 safetensors를 거쳐서 로딩)
+    from export_onnx import export_onnx
+    for directory in directories:
+        if os.access(directory, os.W_OK):
+            sam_model = load_converted(find_or_convert(model_dir, 'float32', model_type), 'float32', model_type)
+            return export_onnx(sam_model, onnx_paths(directory, weights_dtype, model_type), weights_dtype)
+    raise ValueError(f"No writable directory to export ONNX models for {model_type}")
+
+def load_model(model_dir, engine=SAM_ENGINE, model_type=SAM_MODEL_TYPE, weights_dtype=SAM_WEIGHTS_DTYPE):
+    if engine == 'onnx':
+        return OnnxSam(*find_or_export(model_dir, weights_dtype, model_type))
+    if engine == 'torch':
+        return load_converted(find_or_convert(model_dir, weights_dtype, model_type), weights_dtype, model_type)
+    raise ValueError(f"Unsupported SAM engine: {engine}")
 
 def model_fn(model_dir):
     try:
-        checkpoint_path = os.path.join(model_dir, 'sam_vit_h_4b8939.pth')
-        sam_model = sam_model_registry['default'](checkpoint=checkpoint_path)
+        started = time.perf_counter()
+        with telemetry.span('model_load', engine=SAM_ENGINE, model_type=SAM_MODEL_TYPE, weights_dtype=SAM_WEIGHTS_DTYPE):
+            sam_model = load_model(model_dir)
+        print(f"Loaded SAM {SAM_MODEL_TYPE} ({SAM_ENGINE}, {SAM_WEIGHTS_DTYPE}) in {time.perf_counter() - started:.2f}s")
         return sam_model
     except Exception as e:
         print(f"Error loading model: {e}")
@@ -24,47 +391,84 @@ def input_fn(request_body, request_content_type):
         print(f"Error in input_fn: {e}")
         raise
 
-def predict_fn(input_data, model):
-    try:
-        bucket = input_data['bucket']
-        key = input_data['key']
-        bounding_box = input_data['bounding_box']
-
-        # S3에서 이미지 다운로드
-        s3 = boto3.client('s3')
-        download_path = '/tmp/image.jpg'
-        s3.download_file(bucket, key, download_path)
-
-        image = Image.open(download_path)
-        image_np = np.array(image)
+def read_image_bytes(input_data):
+    # S3에서 이미지를 /tmp 없이 메모리로 바로 읽음 (동시 요청끼리 파일 경로 충돌 없음)
+    response = s3_client.get_object(Bucket=input_data['bucket'], Key=input_data['key'])
+    return response['Body'].read()
 
-        sam_predictor = SamPredictor(model)
+def predict_batch_fn(input_batch, model):
+    # 요청별 결과 또는 예외를 입력 순서대로 반환
+    results = [None] * len(input_batch)
+    valid_indices = []
+    image_bytes_list = []
+    for i, input_data in enumerate(input_batch):
+        try:
+            with telemetry.span('sam_read_image', request_id=input_data.get('request_id')):
+                image_bytes_list.append(read_image_bytes(input_data))
+            valid_indices.append(i)
+        except Exception as e:
+            print(f"Error reading image for batch item {i}: {e}")
+            results[i] = e
 
-        # 바운딩 박스 좌표 변환
-        left = bounding_box['Left'] * image_np.shape[1]
-        top = bounding_box['Top'] * image_np.shape[0]
-        width = bounding_box['Width'] * image_np.shape[1]
-        height = bounding_box['Height'] * image_np.shape[0]
+    if not valid_indices:
+        return results
 
-        # numpy 배열로 변환
-        box_np = np.array([[left, top, left + width, top + height]])
+    # 컨테이너는 여러 요청을 한 배치로 처리하므로 request_id를 전역이 아닌 인자로 전달
+    request_ids = [input_batch[i].get('request_id') for i in valid_indices]
+    with sam_predictor_lock:
+        predictor = get_predictor(model)
+        embeddings = get_embeddings(model, predictor, image_bytes_list, request_ids)
+        for i, embedding in zip(valid_indices, embeddings):
+            try:
+                with telemetry.span('sam_decode', request_id=input_batch[i].get('request_id')):
+                    bounding_boxes = input_batch[i].get('bounding_boxes') or [input_batch[i]['bounding_box']]
+                    results[i] = predict_with_embedding(predictor, embedding, bounding_boxes)
+                # 요청 정보(request_id, 원본 키, 박스 등)를 결과에 그대로 실어 보내서 imgCutting이 추가 조회 없이 처리
+                results[i]['metadata'] = input_batch[i]
+            except Exception as e:
+                print(f"Error predicting batch item {i}: {e}")
+                results[i] = e
 
-        # 예측
-        sam_predictor.set_image(image_np)
-        masks, _, _ = sam_predictor.predict(box=box_np)
-
-        result = {
-            'masks': masks.tolist()
-        }
+    print(f"Processed batch of {len(input_batch)}, embedding cache stats: {embedding_cache.stats()}")
+    return results
 
+def predict_fn(input_data, model):
+    try:
+        result = predict_batch_fn([input_data], model)[0]
+        if isinstance(result, Exception):
+            raise result
         return result
     except Exception as e:
         print(f"Error in predict_fn: {e}")
         raise
 
+def encode_masks(masks, compression=MASK_COMPRESSION, metadata=None):
+    masks = np.asarray(masks, dtype=bool)
+
+    # 각 행을 바이트 단위로 패킹해서 마스크 한 장씩 독립적으로 읽을 수 있게 함
+    payload = np.packbits(masks, axis=-1).tobytes()
+    if compression == 'zlib':
+        payload = zlib.compress(payload, 6)
+    elif compression != 'none':
+        raise ValueError(f"Unsupported mask compression: {compression}")
+
+    header = json.dumps({
+        'shape': list(masks.shape),
+        'packing': 'packbits-row',
+        'compression': compression,
+        'metadata': metadata
+    }).encode('utf-8')
+    return MASK_MAGIC + struct.pack('>I', len(header)) + header + payload
+
 def output_fn(prediction, response_content_type):
     try:
-        return json.dumps(prediction), response_content_type
+        # Accept 헤더에 압축 포맷이 있을 때만 바이너리로 응답하고, 나머지는 JSON으로 응답
+        if response_content_type and MASK_CONTENT_TYPE in response_content_type:
+            return encode_masks(prediction['masks'], metadata=prediction.get('metadata')), MASK_CONTENT_TYPE
+
+        body = dict(prediction)
+        body['masks'] = np.asarray(prediction['masks']).tolist()
+        return json.dumps(body), 'application/json'
     except Exception as e:
         print(f"Error in output_fn: {e}")
         raise
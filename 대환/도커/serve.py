@@ -1,26 +1,103 @@
-from flask import Flask, request, jsonify
-from inference import model_fn, predict_fn
+import os
+import threading
+import time
+import torch
+from flask import Flask, Response, request, jsonify
+from batching import MicroBatcher
+from inference import model_fn, input_fn, predict_batch_fn, output_fn
+
+# 마이크로 배칭 설정: 최대 배치 크기 또는 최대 대기 시간 중 먼저 도달하는 쪽에서 배치 실행
+MAX_BATCH_SIZE = int(os.environ.get('SAM_MAX_BATCH_SIZE', '4'))
+MAX_BATCH_WAIT_MS = float(os.environ.get('SAM_MAX_BATCH_WAIT_MS', '20'))
+
+# 프로세스당 동시에 받아둘 수 있는 /invocations 요청 수 (처리 중 + 대기), 넘으면 503으로 바로 거절
+# gunicorn에서는 gunicorn.conf.py가 워커 스레드 수보다 작게 맞춰서 설정함 (/ping용 스레드 확보)
+MAX_PENDING_REQUESTS = int(os.environ.get('SAM_MAX_PENDING_REQUESTS', str(MAX_BATCH_SIZE * 4)))
+
+# 프로세스당 torch 연산 스레드 수 (0이면 CPU 코어 수 / 워커 수)
+TORCH_THREADS = int(os.environ.get('SAM_TORCH_THREADS', '0'))
+
+# 모델 로딩 설정: import 시점에 바로 로딩 시작 (__main__ 실행이 아닌 WSGI 서버에서도 모델이 준비되도록)
+# 'background'는 로딩 중에도 /ping에 응답하고, 'sync'는 import가 끝날 때 로딩도 끝남
+MODEL_DIR = os.environ.get('SAM_MODEL_DIR', '/opt/ml/model')
+MODEL_LOAD_MODE = os.environ.get('SAM_MODEL_LOAD_MODE', 'background')
 
 app = Flask(__name__)
 model = None
+model_ready = threading.Event()
+model_status = {'load_seconds': None, 'error': None}
+batcher = None
+batcher_lock = threading.Lock()
+pending_slots = threading.BoundedSemaphore(MAX_PENDING_REQUESTS)
+
+def process_batch(inputs):
+    # 모델 로딩이 끝날 때까지 기다린 뒤 배치 실행
+    model_ready.wait()
+    return predict_batch_fn(inputs, model)
+
+def get_batcher():
+    # 배칭 스레드는 fork 이후 각 워커에서 처음 요청을 받을 때 생성 (fork 전에 만든 스레드는 자식에 복사되지 않음)
+    global batcher
+    with batcher_lock:
+        if batcher is None:
+            batcher = MicroBatcher(process_batch, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS)
+        return batcher
 
 def load_model():
     global model
-    model_dir = '/opt/ml/model'
-    model = model_fn(model_dir)
+    started = time.perf_counter()
+    try:
+        model = model_fn(MODEL_DIR)
+    except Exception as e:
+        model_status['error'] = str(e)
+        raise
+    finally:
+        model_status['load_seconds'] = time.perf_counter() - started
+        model_ready.set()
+
+def configure_torch_threads(workers=1):
+    # 워커 여러 개가 각자 모든 코어를 쓰면 서로 경합하므로 코어를 나눠서 사용
+    threads = TORCH_THREADS or max(1, (os.cpu_count() or 1) // max(1, workers))
+    torch.set_num_threads(threads)
+    print(f"Using {threads} torch threads (pid {os.getpid()})")
+
+def start_model_loading():
+    if MODEL_LOAD_MODE == 'sync':
+        load_model()
+    else:
+        threading.Thread(target=load_model, daemon=True).start()
 
 @app.route('/ping', methods=['GET'])
 def ping():
     health = model is not None  # Check if the model is loaded
     status = 200 if health else 404
-    return jsonify(status=status)
+    if model_status['error']:
+        status = 500
+    return jsonify(
+        status=status,
+        load_seconds=model_status['load_seconds'],
+        error=model_status['error']
+    ), status
 
 @app.route('/invocations', methods=['POST'])
 def invocations():
-    data = request.get_json()
-    result = predict_fn(data, model)
-    return jsonify(result)
+    if model_status['error']:
+        return jsonify(error=model_status['error']), 500
+
+    # 대기열이 가득 차면 기다리게 하지 않고 바로 503 (SageMaker/클라이언트가 재시도)
+    if not pending_slots.acquire(blocking=False):
+        return jsonify(error='Too many pending requests'), 503, {'Retry-After': '1'}
+    try:
+        data = input_fn(request.get_data(), request.mimetype)
+        result = get_batcher().submit(data)
+        body, content_type = output_fn(result, request.headers.get('Accept'))
+    finally:
+        pending_slots.release()
+    return Response(body, mimetype=content_type)
+
+start_model_loading()
 
 if __name__ == '__main__':
-    load_model()
-    app.run(host='0.0.0.0', port=8080)
+    # 개발용 단일 프로세스 서버 (운영에서는 gunicorn.conf.py로 실행)
+    configure_torch_threads()
+    app.run(host='0.0.0.0', port=8080, threaded=True)
@@ -0,0 +1,35 @@
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+
+# Lambda 쪽 공용 모듈을 SAM 컨테이너 빌드 컨텍스트(도커/)로 복사 (docker build 전에 실행)
+# --check: 복사하지 않고 내용이 다르면 실패 (CI/커밋 전 확인용)
+CONTAINER_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(CONTAINER_DIR, '..', 'lambda')
+SHARED_MODULES = ['telemetry.py']
+
+def main():
+    parser = argparse.ArgumentParser(description='lambda/의 공용 모듈을 도커/로 복사하거나 같은지 확인')
+    parser.add_argument('--check', action='store_true', help='복사하지 않고 다르면 종료 코드 1')
+    args = parser.parse_args()
+
+    stale = []
+    for name in SHARED_MODULES:
+        source = os.path.join(LAMBDA_DIR, name)
+        destination = os.path.join(CONTAINER_DIR, name)
+        if os.path.exists(destination) and filecmp.cmp(source, destination, shallow=False):
+            continue
+        if args.check:
+            stale.append(name)
+        else:
+            shutil.copyfile(source, destination)
+            print(f"Copied lambda/{name} -> 도커/{name}")
+
+    if stale:
+        sys.exit(f"도커/ copies differ from lambda/: {', '.join(stale)} (run python 도커/sync_shared.py)")
+    print("Shared modules are in sync")
+
+if __name__ == '__main__':
+    main()